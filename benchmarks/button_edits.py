@@ -0,0 +1,94 @@
+"""同じメッセージでボタンが同時に押されたときのメッセージ編集の比較
+
+翻訳メッセージごとに、複数人が日本語・英語ボタンを短い間隔で押す状況を再現し、
+Discordへの編集回数と、最終的なEmbedに翻訳行が正しく残っているかを調べる。
+
+- 旧構成: クリックごとに、クリック時点のメッセージ内容へ翻訳行を追加して編集
+  （同時に押されると後の編集が先の翻訳行を上書きする。同じ翻訳先の行が重複することもある）
+- 新構成: MessageEditAggregator がメッセージごとに編集を順番に行い、短時間の翻訳行を1回の編集にまとめる
+
+使い方: python benchmarks/button_edits.py [メッセージ数] [1メッセージあたりのクリック数]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import discord
+
+from common import (FakeChannel, FakeDeepLServer, FakeGoogleTranslator, FakeInteraction, FakeMessage, click_button,
+                    load_bot)
+
+BUTTONS = {"tr:JA": "JA", "tr:EN": "EN"}
+
+
+async def legacy_click(bot, message, target_lang):
+    """変更前のコールバック: クリック時点のEmbedに翻訳行を追加して直接編集する"""
+    original_embed = message.embeds[0]  # Interactionに含まれるクリック時点のメッセージ
+    flag = bot.BUTTON_TARGETS[target_lang][1]
+    result = await bot.translate_original(FakeInteraction(message), target_lang)
+    if not result["success"]:
+        return
+    await message.edit(embed=discord.Embed(description=original_embed.description + f"\n{flag}： "
+                                           + result["translated_text"], color=original_embed.color))
+
+
+async def run(bot, legacy, messages, clicks, seed):
+    channel = FakeChannel(1, api_latency=0.05)
+    rng = random.Random(seed)
+    sent = []
+    for i in range(messages):
+        text = f"Message number {i} for the button edit test"
+        message = FakeMessage(channel, embed=discord.Embed(description=f"🌐 {text}", color=0x00ff00),
+                              view=bot.translation_buttons())
+        bot.message_store.remember(message.id, text, "en")
+        sent.append(message)
+
+    async def click(message, custom_id):
+        await asyncio.sleep(rng.uniform(0, 0.15))  # 複数人がほぼ同時に押す
+        if legacy:
+            await legacy_click(bot, message, BUTTONS[custom_id])
+        else:
+            await click_button(message.view, custom_id, FakeInteraction(message))
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(click(message, rng.choice(list(BUTTONS)))
+                           for message in sent for _ in range(clicks)))
+    elapsed = time.perf_counter() - started_at
+
+    edits = sum(message.edit_count for message in sent)
+    lost = duplicated = 0
+    for message in sent:
+        description = message.embeds[0].description
+        entry = await bot.message_store.get(message.id)
+        for target_lang in entry["translations"]:
+            flag = bot.BUTTON_TARGETS[target_lang][1]
+            count = description.count(f"\n{flag}： ")
+            lost += count == 0
+            duplicated += max(count - 1, 0)
+    label = "旧構成（クリックごとに編集）" if legacy else f"新構成（{bot.BUTTON_EDIT_WINDOW_MS:.0f}ms以内をまとめて編集）"
+    print(f"[{label}]")
+    print(f"  編集回数: {edits}（{edits / messages:.2f}回/メッセージ）  所要時間: {elapsed:.2f}s")
+    print(f"  消えた翻訳行: {lost}  重複した翻訳行: {duplicated}")
+
+
+async def main(messages, clicks):
+    deepl_server = FakeDeepLServer(latency=0.1)
+    await deepl_server.start()
+    try:
+        for legacy in (True, False):
+            bot = load_bot(DEEPL_API_URL=deepl_server.url)
+            FakeGoogleTranslator(latency=0.3).install(bot)
+            await bot.deepl_client.start()
+            try:
+                await run(bot, legacy, messages, clicks, seed=1)
+            finally:
+                await bot.deepl_client.close()
+    finally:
+        await deepl_server.stop()
+
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    clicks = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    asyncio.run(main(messages, clicks))
@@ -0,0 +1,303 @@
+"""ベンチマーク共通ユーティリティ
+
+neo-bot.py をBotを起動せずに読み込む処理と、ローカルで動く偽DeepLサーバーを提供する。
+"""
+import asyncio
+import copy
+import importlib.util
+import os
+import random
+import sys
+import time
+import types
+from collections import deque
+from pathlib import Path
+
+import discord
+from aiohttp import web
+from googletrans.constants import LANGCODES, LANGUAGES, SPECIAL_CASES
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+CORPUS_PATH = Path(__file__).resolve().parent / "data" / "chat_corpus.tsv"
+
+
+def load_bot(**env):
+    """neo-bot.py をモジュールとして読み込む（ダミートークンを設定し、Botは起動しない）"""
+    os.environ.setdefault('DISCORD_TOKEN', 'benchmark-dummy-token')
+    os.environ.setdefault('DEEPL_TOKEN', 'benchmark-dummy-token')
+    for key, value in env.items():
+        os.environ[key] = str(value)
+
+    spec = importlib.util.spec_from_file_location("neo_bot", ROOT_DIR / "neo-bot.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["neo_bot"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_corpus():
+    """チャットコーパスを (言語ラベル, テキスト) のリストで返す"""
+    corpus = []
+    for line in CORPUS_PATH.read_text(encoding="utf-8").splitlines():
+        if not line or line.startswith("#"):
+            continue
+        label, text = line.split("\t", 1)
+        corpus.append((label, text))
+    return corpus
+
+
+class FakeDeepLServer:
+    """/v2/translate を模倣するローカルHTTPサーバー
+
+    latency: 応答遅延（秒）
+    rate_limit: 1秒あたりの最大リクエスト数（超過分は429を返す。Noneで無制限）
+    character_limit: 文字数枠（超過すると456を返す。/v2/usage でも報告）
+    error_rate: 503を返す割合（0.0〜1.0。/v2/usage にも適用）
+    """
+
+    def __init__(self, latency=0.2, rate_limit=None, character_limit=500000, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_count = 0
+        self.rate_limit = rate_limit
+        self.character_limit = character_limit
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self._recent_requests = deque()
+        self.text_count = 0
+        self.characters = 0
+        self._runner = None
+        self.port = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}/v2/translate"
+
+    def _should_fail(self):
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            self.error_count += 1
+            return True
+        return False
+
+    async def _handle_usage(self, request):
+        if self._should_fail():
+            return web.json_response({"message": "Service unavailable"}, status=503)
+        return web.json_response({"character_count": self.characters, "character_limit": self.character_limit})
+
+    def _is_rate_limited(self):
+        if self.rate_limit is None:
+            return False
+        now = time.monotonic()
+        while self._recent_requests and self._recent_requests[0] < now - 1.0:
+            self._recent_requests.popleft()
+        if len(self._recent_requests) >= self.rate_limit:
+            return True
+        self._recent_requests.append(now)
+        return False
+
+    async def _handle_translate(self, request):
+        data = await request.post()
+        self.request_count += 1
+        if self._is_rate_limited():
+            self.rate_limited_count += 1
+            return web.json_response({"message": "Too many requests"}, status=429)
+        if self._should_fail():
+            await asyncio.sleep(self.latency)
+            return web.json_response({"message": "Service unavailable"}, status=503)
+        if self.characters >= self.character_limit:
+            return web.json_response({"message": "Quota exceeded"}, status=456)
+
+        texts = data.getall("text", [])
+        target_lang = data.get("target_lang", "EN")
+
+        self.text_count += len(texts)
+        self.characters += sum(len(text) for text in texts)
+
+        await asyncio.sleep(self.latency)
+        return web.json_response({
+            "translations": [
+                {"detected_source_language": data.get("source_lang", "EN"), "text": f"[{target_lang}] {text}"}
+                for text in texts
+            ]
+        })
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/v2/translate", self._handle_translate)
+        app.router.add_route("*", "/v2/usage", self._handle_usage)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+class FakeGoogleTranslator:
+    """googletrans.Translator の代わり（ワーカースレッド内で遅延を再現する）
+
+    latency: 応答遅延（秒）
+    error_rate: 例外を送出する割合（0.0〜1.0）
+    """
+
+    class _Result:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, latency=0.3, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.call_count = 0
+        self.error_count = 0
+        self.characters = 0
+
+    def translate(self, text, dest="en", src="auto"):
+        self.call_count += 1
+        # googletrans と同じく未対応の言語コードは例外にする（"zh" など）
+        src = src.lower().split("_", 1)[0]
+        dest = dest.lower().split("_", 1)[0]
+        if src != "auto" and src not in LANGUAGES and src not in SPECIAL_CASES and src not in LANGCODES:
+            raise ValueError("invalid source language")
+        if dest not in LANGUAGES and dest not in SPECIAL_CASES and dest not in LANGCODES:
+            raise ValueError("invalid destination language")
+        time.sleep(self.latency)
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            self.error_count += 1
+            raise RuntimeError("fake google error")
+        self.characters += len(text)
+        return self._Result(f"[google:{dest}] {text}")
+
+    def install(self, bot):
+        """Botのgoogle翻訳プールがこのオブジェクトを使うようにする"""
+        bot.google_translator._get_translator = lambda: self
+
+
+def check_embed_limits(embeds):
+    """Discordと同じく、Embedの件数・文字数の上限を超えたメッセージを400で拒否する"""
+    if len(embeds) > 10 or sum(len(embed) for embed in embeds) > 6000 \
+            or any(len(embed.description or "") > 4096 for embed in embeds):
+        raise discord.HTTPException(types.SimpleNamespace(status=400, reason="Bad Request"),
+                                    {"code": 50035, "message": "Invalid Form Body"})
+
+
+class FakeAuthor:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.bot = False
+
+
+class FakeMessage:
+    """on_message・ボタン処理が参照する discord.Message の属性だけを持つ"""
+
+    _next_id = 1000
+
+    def __init__(self, channel, content="", author=None, embed=None, view=None, embeds=None):
+        FakeMessage._next_id += 1
+        self.id = FakeMessage._next_id
+        self.channel = channel
+        self.content = content
+        self.author = author or FakeAuthor(1)
+        self.embeds = [embed] if embed is not None else list(embeds or [])
+        self.view = view
+        self.edit_count = 0
+
+    def edited(self, content):
+        """本文を編集した同じIDのメッセージ（on_message_edit の after）"""
+        message = copy.copy(self)
+        message.content = content
+        return message
+
+    @property
+    def components(self):
+        """送信したViewのボタン（Discordから届く message.components と同じく custom_id と disabled を持つ）"""
+        if self.view is None:
+            return []
+        return [types.SimpleNamespace(children=[getattr(item, "item", item) for item in self.view.children])]
+
+    async def edit(self, embed=None, view=None, embeds=None, **kwargs):
+        await asyncio.sleep(self.channel.api_latency)
+        check_embed_limits([embed] if embed is not None else embeds or [])
+        self.edit_count += 1
+        if embed is not None:
+            self.embeds = [embed]
+        elif embeds is not None:
+            self.embeds = list(embeds)
+        if view is not None:
+            self.view = view
+        return self
+
+
+class FakeChannel:
+    """送信内容を記録するだけのチャンネル（Discord APIの遅延と送信レート制限を再現）
+
+    rate_limit=(件数, 秒) を指定すると、discord.py と同じく上限を超えた送信は空くまで待たされる。
+    on_send には送信したメッセージを渡して呼ぶ関数を指定できる。
+    Embedの件数・文字数がDiscordの上限を超える送信は discord.HTTPException（400）になる。
+    """
+
+    def __init__(self, channel_id, api_latency=0.05, rate_limit=None, on_send=None):
+        self.id = channel_id
+        self.api_latency = api_latency
+        self.rate_limit = rate_limit
+        self.on_send = on_send
+        self.sent = []
+        self.rate_limited_count = 0
+        self.rate_limited_seconds = 0.0
+        self._send_times = []
+
+    async def _wait_rate_limit(self):
+        count, per = self.rate_limit
+        now = time.monotonic()
+        allowed_at = self._send_times[-count] + per if len(self._send_times) >= count else now
+        send_at = max(now, allowed_at)
+        self._send_times.append(send_at)
+        del self._send_times[:-count]
+        if send_at > now:
+            self.rate_limited_count += 1
+            self.rate_limited_seconds += send_at - now
+            await asyncio.sleep(send_at - now)
+
+    async def send(self, content=None, embed=None, view=None, embeds=None, **kwargs):
+        if self.rate_limit is not None:
+            await self._wait_rate_limit()
+        await asyncio.sleep(self.api_latency)
+        check_embed_limits([embed] if embed is not None else embeds or [])
+        message = FakeMessage(self, content or "", author=FakeAuthor(0), embed=embed, view=view, embeds=embeds)
+        self.sent.append(message)
+        if self.on_send is not None:
+            self.on_send(message)
+        return message
+
+
+class FakeInteraction:
+    """ボタンクリックの discord.Interaction の代わり"""
+
+    class _Response:
+        async def defer(self, *args, **kwargs):
+            return None
+
+    class _Followup:
+        def __init__(self):
+            self.sent = []
+
+        async def send(self, content=None, **kwargs):
+            self.sent.append(content)
+
+    def __init__(self, message):
+        self.message = message
+        self.channel_id = message.channel.id
+        self.response = self._Response()
+        self.followup = self._Followup()
+
+
+async def click_button(view, custom_id, interaction):
+    """View のボタンを custom_id で探してコールバックを実行"""
+    for item in view.children:
+        if getattr(item, "custom_id", None) == custom_id:
+            await item.callback(interaction)
+            return
+    raise KeyError(custom_id)
@@ -0,0 +1,57 @@
+"""DeepLマイクロバッチのベンチマーク
+
+レイドイベント時のように、多数のメッセージが同時に翻訳される状況を再現し、
+バッチ無効 / 有効 でDeepLへのリクエスト数・429件数・所要時間を比較する。
+偽DeepLサーバーには1秒あたりのリクエスト上限を設定する。
+
+使い方: python benchmarks/deepl_batching.py [メッセージ数] [遅延秒] [秒間リクエスト上限]
+"""
+import asyncio
+import sys
+import time
+
+from common import FakeDeepLServer, load_bot
+
+TARGETS = ["KO", "ZH-HANT", "JA", "EN"]
+
+
+async def run_burst(bot, server, messages, window):
+    server.request_count = 0
+    server.rate_limited_count = 0
+    batcher = bot.DeepLBatcher(bot.deepl_client, window=window)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        batcher.translate(text, TARGETS[i % len(TARGETS)], "EN") for i, text in enumerate(messages)
+    ))
+    elapsed = time.perf_counter() - start
+
+    rate_limited = sum(1 for status, _ in results if status == 429)
+    label = "バッチ無効" if window <= 0 else f"バッチ有効（{window * 1000:.0f}ms）"
+    print(f"  {label:<16} リクエスト: {server.request_count:4d}  "
+          f"429: {server.rate_limited_count:4d}（フォールバック対象 {rate_limited:4d}件）  "
+          f"所要時間: {elapsed * 1000:7.1f}ms")
+
+
+async def main(count, latency, rate_limit):
+    server = FakeDeepLServer(latency=latency, rate_limit=rate_limit)
+    await server.start()
+    bot = load_bot(DEEPL_API_URL=server.url)
+    messages = [f"raid call-out number {i}, attack the boss now" for i in range(count)]
+
+    try:
+        await bot.deepl_client.start()
+        print(f"📊 メッセージ数: {count} / DeepL遅延: {latency * 1000:.0f}ms / 秒間上限: {rate_limit}")
+        await run_burst(bot, server, messages, window=0)
+        await asyncio.sleep(1.1)  # レート制限の窓をリセット
+        await run_burst(bot, server, messages, window=0.01)
+    finally:
+        await bot.deepl_client.close()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+    rate_limit = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    asyncio.run(main(count, latency, rate_limit))
@@ -0,0 +1,59 @@
+"""DeepL同時翻訳ベンチマーク
+
+偽DeepLサーバー（固定遅延）に対して translate_text を
+1件 / N件逐次 / N件同時 で実行し、所要時間を比較する。
+非同期クライアントであれば N件同時 は 1件 とほぼ同じ時間で完了する。
+
+使い方: python benchmarks/deepl_concurrency.py [同時数] [遅延秒]
+"""
+import asyncio
+import sys
+import time
+
+from common import FakeDeepLServer, load_bot
+
+
+async def main(concurrency, latency):
+    server = FakeDeepLServer(latency=latency)
+    await server.start()
+    # クライアント側のレート制限は計測の対象外なので十分大きくする
+    bot = load_bot(DEEPL_API_URL=server.url, DEEPL_RATE_PER_SECOND=10000, DEEPL_RATE_BURST=10000)
+    # 翻訳キャッシュに当たらないよう、計測ごとに異なる文言を使う
+    sequential_texts = [f"raid message number {i}" for i in range(concurrency)]
+    concurrent_texts = [f"party message number {i}" for i in range(concurrency)]
+
+    try:
+        await bot.deepl_client.start()
+
+        # 接続を温めておく（初回のTCP接続コストを除外）
+        await bot.translate_text("warm up", source_lang="en")
+
+        start = time.perf_counter()
+        await bot.translate_text("single message", source_lang="en")
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for text in sequential_texts:
+            await bot.translate_text(text, source_lang="en")
+        sequential = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(bot.translate_text(text, source_lang="en") for text in concurrent_texts))
+        concurrent = time.perf_counter() - start
+
+        failures = sum(1 for result in results if result.get("service") != "DeepL")
+        print(f"📊 DeepL遅延: {latency * 1000:.0f}ms / メッセージ数: {concurrency}")
+        print(f"  1件:        {single * 1000:8.1f}ms")
+        print(f"  {concurrency}件逐次:   {sequential * 1000:8.1f}ms")
+        print(f"  {concurrency}件同時:   {concurrent * 1000:8.1f}ms  (1件比 {concurrent / single:.2f}倍)")
+        if failures:
+            print(f"⚠️ DeepL以外で処理された翻訳: {failures}件")
+    finally:
+        await bot.deepl_client.close()
+        await server.stop()
+
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    asyncio.run(main(concurrency, latency))
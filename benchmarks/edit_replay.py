@@ -0,0 +1,124 @@
+"""メッセージ編集の再翻訳リプレイ（文ごとのキャッシュあり / なし）
+
+チャットコーパスの同じ言語の行を3文ずつつないだメッセージを送信し、各メッセージを3回編集する。
+1. 誤字の修正（1文の途中の1文字が抜けた状態で送信し、編集で直す）
+2. 文の追加（末尾に1文追加）
+3. 文の削除（先頭の1文を削除）
+
+編集のたびに on_message_edit を呼び、DeepLのリクエスト数・消費文字数と、
+Botの翻訳メッセージが新しく送信されずにその場で書き換えられたかを比較する。
+
+- 文ごとのキャッシュなし（SENTENCE_SEGMENTS=false）: 編集のたびにメッセージ全体を翻訳し直す
+- 文ごとのキャッシュあり: 送信時から文ごとに翻訳・キャッシュし、
+  編集では変わった文だけを翻訳して残りはキャッシュから組み立てる（最初の編集から効く）
+
+使い方: python benchmarks/edit_replay.py [メッセージ数]
+"""
+import asyncio
+import sys
+
+from common import FakeChannel, FakeDeepLServer, FakeGoogleTranslator, FakeMessage, load_bot, load_corpus
+
+LANGUAGES = ["ko", "zh", "en", "ja"]
+SENTENCE_END = ".!?。！？"
+
+
+def join_sentences(sentences):
+    """文末記号があれば空白（中国語・日本語は区切りなし）、なければ改行でつなぐ"""
+    text = sentences[0]
+    for sentence in sentences[1:]:
+        if text[-1] in "。！？":
+            text += sentence
+        elif text[-1] in SENTENCE_END:
+            text += " " + sentence
+        else:
+            text += "\n" + sentence
+    return text
+
+
+def drop_character(sentence):
+    middle = len(sentence) // 2
+    return sentence[:middle] + sentence[middle + 1:]
+
+
+def build_replay(count):
+    """(元のテキスト, [編集後のテキスト, ...]) のリスト"""
+    lines = {language: [text for label, text in load_corpus() if label == language] for language in LANGUAGES}
+    replay = []
+    for i in range(count):
+        language_lines = lines[LANGUAGES[i % len(LANGUAGES)]]
+        start = (i // len(LANGUAGES)) * 4
+        sentences = [language_lines[(start + offset) % len(language_lines)] for offset in range(4)]
+        sentences = [f"{sentence} {i}" if i >= len(language_lines) else sentence for sentence in sentences]
+        body, extra = sentences[:3], sentences[3]
+        with_typo = [body[0], drop_character(body[1]), body[2]]
+        replay.append((join_sentences(with_typo), [
+            join_sentences(body),
+            join_sentences(body + [extra]),
+            join_sentences(body[1:] + [extra])
+        ]))
+    return replay
+
+
+async def run(deepl_server, sentence_segments, replay):
+    # DeepLのレート上限を超えた分がGoogle翻訳に回ると比較できないため、上限は十分に大きくする
+    bot = load_bot(DEEPL_API_URL=deepl_server.url, SENTENCE_SEGMENTS=str(sentence_segments).lower(),
+                   DEEPL_RATE_PER_SECOND=1000, DEEPL_RATE_BURST=1000)
+    google = FakeGoogleTranslator(latency=0.3)
+    google.install(bot)
+    await bot.deepl_client.start()
+    channels = [FakeChannel(200 + i, api_latency=0.02) for i in range(4)]
+    try:
+        requests_before, characters_before = deepl_server.request_count, deepl_server.characters
+        messages = [FakeMessage(channels[i % len(channels)], text) for i, (text, _) in enumerate(replay)]
+        await asyncio.gather(*(bot.on_message(message) for message in messages))
+        sent = sum(len(channel.sent) for channel in channels)
+        initial = (deepl_server.request_count - requests_before, deepl_server.characters - characters_before)
+
+        requests_before, characters_before = deepl_server.request_count, deepl_server.characters
+        naive_characters = 0
+        round_characters = []
+        for round_index in range(len(replay[0][1])):
+            round_before = deepl_server.characters
+            edits = []
+            for i, (_, edited_texts) in enumerate(replay):
+                after = messages[i].edited(edited_texts[round_index])
+                naive_characters += len(after.content)
+                edits.append(bot.on_message_edit(messages[i], after))
+                messages[i] = after
+            await asyncio.gather(*edits)
+            round_characters.append(deepl_server.characters - round_before)
+        edited = (deepl_server.request_count - requests_before, deepl_server.characters - characters_before)
+        reposted = sum(len(channel.sent) for channel in channels) - sent
+        stats = bot.message_edit_info()
+    finally:
+        await bot.deepl_client.close()
+
+    label = "文ごとのキャッシュあり" if sentence_segments else "文ごとのキャッシュなし（全文を翻訳し直す）"
+    print(f"[{label}]")
+    print(f"  初回送信: DeepLリクエスト {initial[0]}  消費文字数 {initial[1]}  翻訳メッセージ {sent}件")
+    print(f"  編集 {stats['received']}回: DeepLリクエスト {edited[0]}  消費文字数 {edited[1]}"
+          f"（全文の文字数 {naive_characters}）")
+    print(f"  編集ごとの消費文字数: 誤字の修正 {round_characters[0]}  文の追加 {round_characters[1]}"
+          f"  文の削除 {round_characters[2]}")
+    print(f"  Google翻訳の呼び出し（全体）: {google.call_count}")
+    print(f"  翻訳メッセージの書き換え {stats['updated']}回  新規送信 {reposted}件  失敗 {stats['failed']}件")
+    return edited
+
+
+async def main(count):
+    replay = build_replay(count)
+    deepl_server = FakeDeepLServer(latency=0.05)
+    await deepl_server.start()
+    try:
+        naive = await run(deepl_server, False, replay)
+        incremental = await run(deepl_server, True, replay)
+    finally:
+        await deepl_server.stop()
+
+    print(f"📊 編集時の削減: DeepLリクエスト {naive[0]} → {incremental[0]}  "
+          f"消費文字数 {naive[1]} → {incremental[1]}（{(1 - incremental[1] / naive[1]) * 100:.1f}%削減）")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 60))
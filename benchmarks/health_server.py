@@ -0,0 +1,169 @@
+"""ヘルスチェックサーバーのベンチマーク（旧Flask構成 / aiohttp構成）
+
+それぞれの構成でBotを別プロセスとして起動し、以下を比較する。
+- メモリ使用量（RSS）とスレッド数
+- / /health /ping への応答時間（逐次・同時）
+- 負荷中のBotのイベントループ遅延（Flaskはスレッドで動くためGILを取り合う）
+
+旧構成の比較にはFlaskが必要（`pip install flask`）。未インストールならaiohttp構成のみ計測する。
+
+使い方: python benchmarks/health_server.py [リクエスト数] [同時数]
+"""
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import aiohttp
+import psutil
+
+from common import load_bot
+
+PATHS = ["/", "/health", "/ping"]
+
+
+def legacy_flask_app(bot):
+    """変更前と同じ構成のFlaskアプリ（/ はリクエストごとにpsutil.Processを作る）"""
+    from flask import Flask, jsonify
+
+    app = Flask('')
+
+    @app.route('/')
+    def health_check():
+        process = psutil.Process()
+        memory_mb = process.memory_info().rss / 1024 / 1024
+        return jsonify({
+            "status": "ok",
+            "message": "Discord Bot is running",
+            "python_version": sys.version,
+            "timestamp": bot.datetime.now().isoformat(),
+            "discord_bot_status": "connected" if bot.client.is_ready() else "connecting",
+            "memory_usage_mb": round(memory_mb, 2),
+            "memory_percent": round(psutil.virtual_memory().percent, 2),
+            "deepl_quota": bot.deepl_quota.stats()
+        })
+
+    @app.route('/health')
+    def health():
+        return jsonify(bot.build_health())
+
+    @app.route('/ping')
+    def ping():
+        return "pong"
+
+    return app
+
+
+async def serve(kind, port):
+    """子プロセス側: Botを読み込み、指定の構成でサーバーを起動して待機する"""
+    bot = load_bot(PORT=port, LOOP_LAG_THRESHOLD_MS=50)
+    asyncio.create_task(bot.event_loop_watchdog.run())
+    if kind == "flask":
+        app = legacy_flask_app(bot)
+        threading.Thread(target=lambda: app.run(host='127.0.0.1', port=port), daemon=True).start()
+    else:
+        await bot.health_server.start()
+    print("READY", flush=True)
+    await asyncio.Event().wait()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(session, base_url):
+    for _ in range(100):
+        try:
+            async with session.get(base_url + "/ping") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("サーバーが起動しませんでした")
+
+
+async def timed_get(session, url):
+    start = time.perf_counter()
+    async with session.get(url) as response:
+        await response.read()
+    return time.perf_counter() - start
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    p99 = ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)]
+    return f"p50 {statistics.median(ordered) * 1000:6.2f}ms  p99 {p99 * 1000:6.2f}ms"
+
+
+async def measure(kind, count, concurrency):
+    port = free_port()
+    child = subprocess.Popen(
+        [sys.executable, __file__, "--serve", kind, str(port)],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    try:
+        while child.stdout.readline().strip() != "READY":
+            if child.poll() is not None:
+                raise RuntimeError(f"{kind} サーバーの起動に失敗しました")
+
+        base_url = f"http://127.0.0.1:{port}"
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, base_url)
+            process = psutil.Process(child.pid)
+            idle_rss = process.memory_info().rss / 1024 / 1024
+            threads = process.num_threads()
+
+            print(f"[{kind}] RSS（待機時）: {idle_rss:6.1f}MB  スレッド数: {threads}")
+            for path in PATHS:
+                samples = [await timed_get(session, base_url + path) for _ in range(count)]
+                print(f"  {path:<8} 逐次 {count}件: {summarize(samples)}")
+
+            start = time.perf_counter()
+            samples = []
+            for _ in range(count // concurrency):
+                samples += await asyncio.gather(*(
+                    timed_get(session, base_url + "/health") for _ in range(concurrency)
+                ))
+            elapsed = time.perf_counter() - start
+            print(f"  /health  同時{concurrency}: {summarize(samples)}  ({len(samples) / elapsed:7.0f} req/s)")
+
+            loaded_rss = process.memory_info().rss / 1024 / 1024
+            async with session.get(base_url + "/health") as response:
+                event_loop = json.loads(await response.read())["event_loop"]
+            print(f"  RSS（負荷後）: {loaded_rss:6.1f}MB  "
+                  f"Botのイベントループ遅延 最大: {event_loop['max_lag_ms']}ms "
+                  f"（50ms超: {event_loop['blocked_count']}回）")
+    finally:
+        child.terminate()
+        child.wait()
+
+
+async def main(count, concurrency):
+    try:
+        import flask  # noqa: F401
+        kinds = ["flask", "aiohttp"]
+    except ImportError:
+        print("⚠️ Flaskが未インストールのため旧構成の計測を省略します")
+        kinds = ["aiohttp"]
+
+    print(f"📊 リクエスト数: {count} / 同時数: {concurrency}")
+    for kind in kinds:
+        await measure(kind, count, concurrency)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        asyncio.run(serve(sys.argv[2], int(sys.argv[3])))
+    else:
+        count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+        concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+        asyncio.run(main(count, concurrency))
@@ -0,0 +1,69 @@
+"""言語判別ベンチマーク
+
+固定のチャットコーパス（benchmarks/data/chat_corpus.tsv）に対して、
+旧実装（メッセージごとに langdetect.detect）と detect_language の
+処理速度（メッセージ/秒）・langdetectとの一致率・正解ラベルとの一致率を比較する。
+
+使い方: python benchmarks/language_detection.py [繰り返し回数]
+"""
+import sys
+import time
+
+from common import load_bot, load_corpus
+
+
+def measure(func, texts, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for text in texts:
+            func(text)
+    elapsed = time.perf_counter() - start
+    return len(texts) * rounds / elapsed
+
+
+def main(rounds):
+    bot = load_bot()
+    corpus = load_corpus()
+    texts = [text for _, text in corpus]
+
+    def legacy_detect(text):
+        # 旧実装: langdetectの結果をそのままマッピング（zh-cn / zh-tw は英語扱いになっていた）
+        try:
+            return bot.DEEPL_SUPPORTED_LANGS.get(bot.detect(text), "en")
+        except bot.LangDetectException:
+            return "en"
+
+    def langdetect_base(text):
+        try:
+            return bot.detect(text).split("-")[0]
+        except bot.LangDetectException:
+            return "en"
+
+    # langdetectのプロファイル読み込みは計測から除外
+    legacy_detect("warm up")
+
+    legacy_rate = measure(legacy_detect, texts, rounds)
+    bot._detect_normalized_language.cache_clear()
+    cold_rate = measure(bot.detect_language, texts, 1)
+    warm_rate = measure(bot.detect_language, texts, rounds)
+
+    labeled = [(label, text) for label, text in corpus if label != "und"]
+    agreement = sum(bot.detect_language(text) == langdetect_base(text) for text in texts) / len(texts)
+    legacy_accuracy = sum(legacy_detect(text) == label for label, text in labeled) / len(labeled)
+    new_accuracy = sum(bot.detect_language(text) == label for label, text in labeled) / len(labeled)
+
+    print(f"📊 コーパス: {len(texts)}件 × {rounds}回")
+    print(f"  旧実装（langdetect）:       {legacy_rate:12,.0f} メッセージ/秒  正解率 {legacy_accuracy:.1%}")
+    print(f"  detect_language（初回）:    {cold_rate:12,.0f} メッセージ/秒  正解率 {new_accuracy:.1%}")
+    print(f"  detect_language（メモ化後）: {warm_rate:12,.0f} メッセージ/秒")
+    print(f"  langdetectとの一致率: {agreement:.1%}")
+    print(f"  判定内訳: {bot.language_detection_info()}")
+
+    mismatches = [(label, text, bot.detect_language(text)) for label, text in labeled
+                  if bot.detect_language(text) != label]
+    for label, text, detected in mismatches:
+        print(f"  ⚠️ 不一致 正解={label} 判定={detected}: {text}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,216 @@
+"""オフライン負荷試験（偽Gateway・偽DeepL・偽Google翻訳）
+
+チャットコーパスを一定のペースで on_message に流し込み（偽Gateway）、
+送信された翻訳メッセージの一部で日本語・英語ボタンをクリックする。
+DeepLはローカルの偽サーバー、Google翻訳はワーカースレッド内の偽Translatorに置き換える。
+
+計測結果:
+- 処理したメッセージ数/秒
+- メッセージ受信から翻訳送信まで・ボタンクリックから編集完了までの p50/p95/p99
+- Discordへの送信メッセージ数と、チャンネルごとの送信レート制限（5秒に5件）で待たされた回数・時間
+- DeepLのリクエスト数・429件数・消費文字数、Google翻訳の呼び出し数
+
+--no-packing で複数の翻訳を1つのメッセージにまとめない（変更前の）送信方法で計測する。
+
+--save で結果をJSONに保存し、--baseline で保存済みの結果との差分を表示する。
+
+使い方: python benchmarks/load_test.py [--messages 500] [--rate 50] [--channels 8] ...
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from common import (FakeChannel, FakeDeepLServer, FakeGoogleTranslator, FakeInteraction,
+                    FakeMessage, click_button, load_bot, load_corpus)
+
+BUTTONS = ["tr:JA", "tr:EN"]
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+
+def latency_summary(samples):
+    return {
+        "count": len(samples),
+        "p50_ms": round(percentile(samples, 50) * 1000, 1),
+        "p95_ms": round(percentile(samples, 95) * 1000, 1),
+        "p99_ms": round(percentile(samples, 99) * 1000, 1)
+    }
+
+
+class LoadTest:
+    def __init__(self, bot, args):
+        self.bot = bot
+        self.args = args
+        rate_limit = (args.channel_rate_limit, 5.0) if args.channel_rate_limit else None
+        self.channels = [FakeChannel(100 + i, api_latency=args.discord_latency, rate_limit=rate_limit,
+                                     on_send=self._on_send) for i in range(args.channels)]
+        self.message_latencies = []
+        self.click_latencies = []
+        self.click_tasks = []
+        self.clicks_failed = 0
+        self.translated_ids = set()
+        bot.outbound_packer.send = self._record_translated(bot.outbound_packer.send)
+        self.random = random.Random(args.seed)
+
+    async def _handle_message(self, message):
+        received_at = time.perf_counter()
+        await self.bot.on_message(message)
+        if message.id in self.translated_ids:
+            self.message_latencies.append(time.perf_counter() - received_at)
+
+    def _record_translated(self, send):
+        """翻訳メッセージを送信した元メッセージを記録するよう outbound_packer.send を包む"""
+
+        async def recording_send(channel, embed, source_id):
+            result = await send(channel, embed, source_id)
+            self.translated_ids.add(source_id)
+            return result
+
+        return recording_send
+
+    def _on_send(self, sent_message):
+        """翻訳メッセージの各Embedについて、一部でボタンをクリックする"""
+        if sent_message.view is None:
+            return
+        for index in range(len(sent_message.embeds)):
+            if self.random.random() < self.args.click_ratio:
+                self.click_tasks.append(asyncio.create_task(self._click(sent_message, index)))
+
+    async def _click(self, sent_message, index):
+        await asyncio.sleep(self.random.uniform(0.1, 1.0))  # 人がボタンを押すまでの時間
+        custom_id = self.random.choice(BUTTONS)
+        if len(sent_message.embeds) > 1:
+            custom_id = f"{custom_id}:{index}:{sent_message.view.children[index * len(BUTTONS)].source_id}"
+        interaction = FakeInteraction(sent_message)
+        started_at = time.perf_counter()
+        await click_button(sent_message.view, custom_id, interaction)
+        if interaction.followup.sent:
+            self.clicks_failed += 1
+        else:
+            self.click_latencies.append(time.perf_counter() - started_at)
+
+    async def run(self, corpus):
+        """偽Gateway: コーパスを rate 件/秒 で各チャンネルに順番に配信"""
+        texts = [text for _, text in corpus]
+        interval = 1 / self.args.rate
+        tasks = []
+        started_at = time.perf_counter()
+        for i in range(self.args.messages):
+            channel = self.channels[i % len(self.channels)]
+            text = texts[i % len(texts)]
+            if i >= len(texts):
+                text = f"{text} ({i // len(texts)})"  # 2周目以降はキャッシュに当たらないよう変える
+            tasks.append(asyncio.create_task(self._handle_message(FakeMessage(channel, text))))
+            await asyncio.sleep(max(started_at + (i + 1) * interval - time.perf_counter(), 0))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started_at
+        await asyncio.gather(*self.click_tasks)
+        return elapsed
+
+
+async def main(args):
+    deepl_server = FakeDeepLServer(latency=args.deepl_latency, rate_limit=args.deepl_rate_limit,
+                                   error_rate=args.deepl_error_rate)
+    await deepl_server.start()
+    bot = load_bot(DEEPL_API_URL=deepl_server.url, OUTBOUND_PACKING=str(not args.no_packing).lower())
+    google = FakeGoogleTranslator(latency=args.google_latency, error_rate=args.google_error_rate)
+    google.install(bot)
+    corpus = load_corpus()
+
+    try:
+        await bot.deepl_client.start()
+        bot.detect_language("warm up")  # langdetectのプロファイル読み込みは計測に含めない
+        load_test = LoadTest(bot, args)
+        elapsed = await load_test.run(corpus)
+    finally:
+        await bot.deepl_client.close()
+        await deepl_server.stop()
+
+    translated = len(load_test.message_latencies)
+    results = {
+        "messages": args.messages,
+        "translated": translated,
+        "messages_per_second": round(translated / elapsed, 1),
+        "message_latency": latency_summary(load_test.message_latencies),
+        "click_latency": latency_summary(load_test.click_latencies),
+        "clicks_failed": load_test.clicks_failed,
+        "discord_messages": sum(len(channel.sent) for channel in load_test.channels),
+        "discord_rate_limited": sum(channel.rate_limited_count for channel in load_test.channels),
+        "discord_rate_limited_seconds": round(
+            sum(channel.rate_limited_seconds for channel in load_test.channels), 1),
+        "deepl_requests": deepl_server.request_count,
+        "deepl_429": deepl_server.rate_limited_count,
+        "deepl_errors": deepl_server.error_count,
+        "deepl_characters": deepl_server.characters,
+        "google_calls": google.call_count,
+        "google_characters": google.characters,
+        "services": bot.translation_pipeline.stats()["by_service"]
+    }
+    return results
+
+
+def print_results(results, baseline=None):
+    def delta(key, sub=None):
+        if baseline is None or key not in baseline:
+            return ""
+        old = baseline[key][sub] if sub else baseline[key]
+        new = results[key][sub] if sub else results[key]
+        if not old:
+            return ""
+        return f"  ({(new - old) / old * 100:+.1f}%)"
+
+    print(f"📊 翻訳 {results['translated']}/{results['messages']}件  "
+          f"{results['messages_per_second']} msg/s{delta('messages_per_second')}")
+    for key, label in (("message_latency", "受信→翻訳送信"), ("click_latency", "クリック→編集")):
+        summary = results[key]
+        print(f"  {label:<10} {summary['count']:4d}件  " + "  ".join(
+            f"{p} {summary[p + '_ms']:7.1f}ms{delta(key, p + '_ms')}" for p in ("p50", "p95", "p99")))
+    print(f"  Discord: 送信メッセージ {results['discord_messages']}{delta('discord_messages')}  "
+          f"レート制限の待ち {results['discord_rate_limited']}回 / "
+          f"{results['discord_rate_limited_seconds']}秒{delta('discord_rate_limited_seconds')}")
+    print(f"  DeepL: リクエスト {results['deepl_requests']}  429 {results['deepl_429']}  "
+          f"エラー {results['deepl_errors']}  消費文字数 {results['deepl_characters']}{delta('deepl_characters')}")
+    print(f"  Google翻訳: 呼び出し {results['google_calls']}  文字数 {results['google_characters']}")
+    print(f"  採用サービス: {results['services']}  ボタン失敗: {results['clicks_failed']}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="オフライン負荷試験")
+    parser.add_argument("--messages", type=int, default=500, help="配信するメッセージ数")
+    parser.add_argument("--rate", type=float, default=50, help="1秒あたりの配信メッセージ数")
+    parser.add_argument("--channels", type=int, default=8, help="チャンネル数")
+    parser.add_argument("--click-ratio", type=float, default=0.2, help="ボタンをクリックする翻訳メッセージの割合")
+    parser.add_argument("--deepl-latency", type=float, default=0.15, help="偽DeepLの応答遅延（秒）")
+    parser.add_argument("--deepl-rate-limit", type=int, default=None, help="偽DeepLの秒間リクエスト上限（超過で429）")
+    parser.add_argument("--deepl-error-rate", type=float, default=0.0, help="偽DeepLが503を返す割合")
+    parser.add_argument("--google-latency", type=float, default=0.3, help="偽Google翻訳の応答遅延（秒）")
+    parser.add_argument("--google-error-rate", type=float, default=0.0, help="偽Google翻訳が失敗する割合")
+    parser.add_argument("--discord-latency", type=float, default=0.05, help="Discord送信・編集の遅延（秒）")
+    parser.add_argument("--channel-rate-limit", type=int, default=5,
+                        help="Discordのチャンネルごとの5秒あたりの送信上限（0で無制限）")
+    parser.add_argument("--no-packing", action="store_true", help="翻訳をまとめずに1件ずつ送信する（変更前の送信方法）")
+    parser.add_argument("--seed", type=int, default=1, help="クリック対象を選ぶ乱数のシード")
+    parser.add_argument("--save", help="結果を保存するJSONファイル")
+    parser.add_argument("--baseline", help="比較する保存済みの結果（JSON）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果を保存しました: {args.save}")
@@ -0,0 +1,44 @@
+"""翻訳しない部分（メンション・絵文字・URL・コードなど）の除外による文字数削減レポート
+
+チャットコーパス（benchmarks/data/chat_corpus.tsv）の各メッセージについて、
+そのまま送った場合と、翻訳しない部分を除いて送った場合のDeepL消費文字数を比較する。
+
+使い方: python benchmarks/protected_spans.py [-v]
+"""
+import sys
+
+from common import load_bot, load_corpus
+
+
+def main(verbose):
+    bot = load_bot()
+    corpus = load_corpus()
+
+    characters_before = 0
+    characters_after = 0
+    segmented = 0
+    skipped = 0
+    for _, text in corpus:
+        if len(text.strip()) < 2:
+            continue  # on_message で無視される
+        characters_before += len(text)
+        segments = bot.split_protected_spans(text)
+        translatable = [segment for is_translatable, segment in segments if is_translatable]
+        characters_after += sum(len(segment) for segment in translatable)
+        if not translatable:
+            skipped += 1
+            if verbose:
+                print(f"  ⏭️ 翻訳不要: {text}")
+        elif len(segments) > 1:
+            segmented += 1
+            if verbose:
+                print(f"  ✂️ {text!r} → {translatable}")
+
+    saved = characters_before - characters_after
+    print(f"📊 メッセージ数: {len(corpus)}（分割して翻訳: {segmented}件 / 翻訳不要で省略: {skipped}件）")
+    print(f"  DeepL消費文字数: {characters_before} → {characters_after}  "
+          f"（{saved}文字削減、{saved / characters_before * 100:.1f}%）")
+
+
+if __name__ == "__main__":
+    main("-v" in sys.argv[1:])
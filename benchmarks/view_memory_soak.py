@@ -0,0 +1,86 @@
+"""翻訳ボタンのメモリ使用量のソーク試験
+
+翻訳メッセージの送信（Viewの登録と元テキストの保存）を大量に繰り返し、
+一定件数ごとにPythonのメモリ使用量（tracemalloc）とRSSを記録する。
+
+- 旧構成: メッセージごとに元テキストを持つ TranslationView（timeout=None）を登録
+- 新構成: custom_id で処理を選ぶ TranslateButton（メッセージごとのViewは保持されない）
+
+どちらもメッセージ保存（MESSAGE_STORE_MAX_ENTRIES 件のLRU）には元テキストを保存する。
+新構成ではメッセージ保存の上限に達した後はメモリが増えないことを確認する。
+
+使い方: python benchmarks/view_memory_soak.py [メッセージ数] [記録間隔]
+"""
+import asyncio
+import gc
+import sys
+import tracemalloc
+
+import discord
+import psutil
+
+from common import load_bot, load_corpus
+
+
+def legacy_view_class():
+    """変更前と同じ、元テキストを保持するメッセージごとのView"""
+
+    class TranslationView(discord.ui.View):
+        def __init__(self, original_text, source_lang):
+            super().__init__(timeout=None)
+            self.original_text = original_text
+            self.source_lang = source_lang
+
+        @discord.ui.button(label="日本語", style=discord.ButtonStyle.primary, custom_id="translate_to_japanese")
+        async def japanese_button(self, interaction, button):
+            pass
+
+        @discord.ui.button(label="English", style=discord.ButtonStyle.primary, custom_id="translate_to_english")
+        async def english_button(self, interaction, button):
+            pass
+
+    return TranslationView
+
+
+async def soak(bot, legacy, count, interval):
+    state = bot.client._connection
+    texts = [text for _, text in load_corpus()]
+    TranslationView = legacy_view_class()
+    process = psutil.Process()
+
+    label = "旧構成（メッセージごとのView）" if legacy else "新構成（DynamicItem）"
+    print(f"[{label}] メッセージ保存の上限: {bot.message_store.max_entries}件")
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for i in range(1, count + 1):
+        message_id = 10 ** 17 + i
+        # Discordから届くメッセージごとに別の文字列オブジェクトになるよう複製する
+        text = "".join(list(texts[i % len(texts)]))
+        if legacy:
+            view = TranslationView(original_text=text, source_lang="zh")
+        else:
+            view = bot.translation_buttons()
+        state.store_view(view, message_id)  # channel.send(view=...) と同じ登録処理
+        bot.message_store.remember(message_id, text, "zh")
+
+        if i % interval == 0:
+            current = tracemalloc.get_traced_memory()[0] - baseline
+            print(f"  {i:7d}件: Python {current / 1024 / 1024:7.1f}MB  "
+                  f"RSS {process.memory_info().rss / 1024 / 1024:7.1f}MB  "
+                  f"保持中のView {len(state._view_store._synced_message_views):7d}")
+            await asyncio.sleep(0)
+    tracemalloc.stop()
+
+
+async def main(count, interval):
+    bot = load_bot()
+    legacy = "--legacy" in sys.argv
+    await soak(bot, legacy, count, interval)
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    count = int(args[0]) if args else 100000
+    interval = int(args[1]) if len(args) > 1 else 10000
+    asyncio.run(main(count, interval))
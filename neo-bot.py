@@ -1,17 +1,31 @@
+import time
+STARTUP_STARTED_AT = time.perf_counter()  # 起動フェーズ計測の基準時刻
+
 import discord
 from discord.ui import View, Button
-import requests
+import aiohttp
+from aiohttp import web
 import os
+import re
 import sys
 import asyncio
 import gc
-import psutil
+import json
+import sqlite3
+import traceback
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime
-from langdetect import detect
+from urllib.parse import quote_plus
+from xml.sax.saxutils import escape as xml_escape, unescape as xml_unescape
+from functools import lru_cache
+from langdetect import DetectorFactory, detect
 from langdetect.lang_detect_exception import LangDetectException
-from flask import Flask, jsonify
-from threading import Thread
-from googletrans import Translator
+from threading import Thread, get_ident, local
+# psutil・googletransは起動を速くするため使用時に遅延インポートする
 
 # 環境変数からトークンを取得（セキュリティ向上）
 DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
@@ -41,112 +55,1094 @@ if EXCLUDED_CHANNEL_IDS.strip():
         print("⚠️ 除外チャンネルIDの形式が正しくありません")
         excluded_channels = set()
 
+# 起動フェーズの計測（デプロイごとの初回翻訳までの時間を追跡）
+startup_phases = {}
+
+
+def record_startup_phase(name):
+    """起動開始からの経過時間を記録して表示（各フェーズ初回のみ）"""
+    if name in startup_phases:
+        return
+    startup_phases[name] = round(time.perf_counter() - STARTUP_STARTED_AT, 3)
+    print(f"⏱️ 起動フェーズ {name}: {startup_phases[name]:.3f}秒")
+
+
+record_startup_phase("imports")
+
+# メトリクス（/metrics でPrometheusのテキスト形式で公開）
+# 記録はdictの加算のみで、集計・整形は取得時に行う
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """単調増加するカウンター（ラベルごと）"""
+
+    type_name = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, label_values)} {value}"
+
+
+class Gauge:
+    """取得時に関数を呼んで値を読むゲージ"""
+
+    type_name = "gauge"
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def samples(self):
+        yield f"{self.name} {self.read()}"
+
+
+class Histogram:
+    """レイテンシなどの分布（ラベルごとにバケット数・合計・件数を保持）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # ラベル値 -> [バケットごとの件数..., +Inf件数, 合計]
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """with ブロックの所要時間を記録"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, *label_values)
+
+    def samples(self):
+        for label_values, series in list(self._series.items()):
+            series = list(series)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, [("le", bound)])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {series[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, read):
+        return self.register(Gauge(name, help_text, read))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+detection_seconds = metrics.histogram(
+    "translator_language_detection_seconds", "Language detection latency")
+backend_seconds = metrics.histogram(
+    "translator_backend_seconds", "Translation backend latency", labels=("backend", "outcome"))
+cache_lookup_seconds = metrics.histogram(
+    "translator_cache_lookup_seconds", "Translation cache lookup latency", labels=("result",))
+discord_send_seconds = metrics.histogram(
+    "translator_discord_send_seconds", "message.channel.send latency")
+interaction_edit_seconds = metrics.histogram(
+    "translator_interaction_edit_seconds", "Button interaction message edit latency", labels=("lines",))
+event_loop_lag_seconds = metrics.histogram(
+    "translator_event_loop_lag_seconds", "Event loop scheduling lag")
+scheduler_wait_seconds = metrics.histogram(
+    "translator_scheduler_wait_seconds", "Time queued before a translation slot was granted")
+coalesced_total = metrics.counter(
+    "translator_coalesced_total", "Translations that shared an identical in-flight request")
+translations_total = metrics.counter(
+    "translator_translations_total", "Translations returned", labels=("target_lang", "service"))
+translated_characters_total = metrics.counter(
+    "translator_translated_characters_total", "Characters sent to translation backends",
+    labels=("target_lang", "service"))
+
+# イベントループ監視（ブロッキング処理でGatewayのハートビートが遅れるのを早期に検知）
+EVENT_LOOP_LAG_INTERVAL = 0.5  # イベントループ遅延の計測間隔（秒）
+LOOP_LAG_THRESHOLD_MS = float(os.getenv('LOOP_LAG_THRESHOLD_MS', '250'))  # これ以上の遅延をブロックとして記録
+LOOP_WATCHDOG_DEBUG = os.getenv('LOOP_WATCHDOG_DEBUG', '').lower() in ('1', 'true', 'yes')  # ブロック中のスタックを取得
+
+event_loop_lag_current_seconds = metrics.gauge(
+    "translator_event_loop_lag_current_seconds", "Most recent event loop scheduling lag",
+    lambda: event_loop_watchdog.current_lag)
+event_loop_blocks_total = metrics.counter(
+    "translator_event_loop_blocks_total", "Event loop stalls longer than the lag threshold")
+
+
+class EventLoopWatchdog:
+    """イベントループの遅延を計測し、しきい値を超えたブロックを記録する
+
+    ループ側のタスクが一定間隔でsleepして遅延を測り、別スレッドがその進み具合を監視する。
+    デバッグモードでは、ループが止まっている間に別スレッドからループスレッドのスタックを取得する。
+    """
+
+    def __init__(self, interval, threshold, capture_stacks=False):
+        self.interval = interval
+        self.threshold = threshold
+        self.capture_stacks = capture_stacks
+        self.current_lag = 0.0
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self.last_block = None
+        self._last_tick = time.monotonic()
+        self._loop_thread_id = None
+        self._pending_stack = None
+
+    async def run(self):
+        self._loop_thread_id = get_ident()
+        if self.capture_stacks:
+            # 1回のコールバックが長いものはasyncioのデバッグ機能でもログに出す
+            loop = asyncio.get_running_loop()
+            loop.slow_callback_duration = self.threshold
+            loop.set_debug(True)
+            Thread(target=self._watch, daemon=True).start()
+
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - self._last_tick - self.interval, 0.0)
+            self.current_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            event_loop_lag_seconds.observe(lag)
+            if lag >= self.threshold:
+                self._report(lag)
+
+    def _watch(self):
+        """ループスレッドが止まっている間にそのスタックを取得（別スレッドで実行）"""
+        while True:
+            time.sleep(self.threshold / 2)
+            stalled = time.monotonic() - self._last_tick - self.interval
+            if stalled >= self.threshold and self._pending_stack is None:
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    self._pending_stack = "".join(traceback.format_stack(frame))
+
+    def _report(self, lag):
+        self.blocked_count += 1
+        event_loop_blocks_total.inc()
+        self.last_block = {
+            "timestamp": datetime.now().isoformat(),
+            "lag_ms": round(lag * 1000, 1),
+            "stack": self._pending_stack
+        }
+        self._pending_stack = None
+        print("🐢 event_loop_blocked " + json.dumps(self.last_block, ensure_ascii=False))
+
+    def stats(self):
+        return {
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "debug": self.capture_stacks,
+            "current_lag_ms": round(self.current_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "blocked_count": self.blocked_count,
+            "last_block": self.last_block
+        }
+
+
+event_loop_watchdog = EventLoopWatchdog(
+    EVENT_LOOP_LAG_INTERVAL, LOOP_LAG_THRESHOLD_MS / 1000, capture_stacks=LOOP_WATCHDOG_DEBUG)
+
+
 # Discord設定
 intents = discord.Intents.default()
 intents.message_content = True
-client = discord.Client(intents=intents)
-
-# フォールバック翻訳器（GoogleTranslate）
-google_translator = Translator()
-
-# Keep-Alive機能（Flaskサーバー）
-app = Flask('')
-
-@app.route('/')
-def health_check():
-    """ヘルスチェック用エンドポイント"""
-    # メモリ使用量を取得
-    process = psutil.Process()
-    memory_info = process.memory_info()
-    memory_mb = memory_info.rss / 1024 / 1024
-    
-    return jsonify({
+
+# シャーディング設定（ギルド数が多い場合にGatewayの処理を複数プロセス・複数コアに分ける）
+SHARD_COUNT = os.getenv('SHARD_COUNT', '').strip().lower()  # 未設定: なし / auto: Discordの推奨数 / 数値: 全体のシャード数
+SHARD_IDS = os.getenv('SHARD_IDS', '')  # このプロセスが担当するシャード（例: 0-3 または 0,1。未設定なら全シャード）
+
+
+def parse_shard_ids(value):
+    """'0-3,6' のような指定をシャードIDのリストに変換"""
+    shard_ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            shard_ids.extend(range(int(first), int(last) + 1))
+        else:
+            shard_ids.append(int(part))
+    return sorted(set(shard_ids))
+
+
+shard_options = {}
+SHARD_RATE_SHARE = 1.0  # このプロセスが使うDeepLレート上限の割合（担当シャード数 / 全体のシャード数）
+try:
+    if SHARD_COUNT and SHARD_COUNT != 'auto':
+        shard_options["shard_count"] = int(SHARD_COUNT)
+        if SHARD_IDS.strip():
+            shard_options["shard_ids"] = parse_shard_ids(SHARD_IDS)
+            if max(shard_options["shard_ids"]) >= shard_options["shard_count"]:
+                raise ValueError("SHARD_IDS は SHARD_COUNT 未満にしてください")
+            SHARD_RATE_SHARE = len(shard_options["shard_ids"]) / shard_options["shard_count"]
+    elif SHARD_IDS.strip():
+        raise ValueError("SHARD_IDS を使う場合は SHARD_COUNT に全体のシャード数を指定してください")
+except ValueError as e:
+    print(f"エラー: シャーディング設定が正しくありません: {e}")
+    exit()
+
+SHARDING_ENABLED = bool(SHARD_COUNT)
+if SHARDING_ENABLED:
+    print(f"🧩 シャーディング有効: 全体 {shard_options.get('shard_count', 'auto')} / "
+          f"担当 {shard_options.get('shard_ids', '全シャード')}")
+
+
+class TranslatorBotClient(discord.AutoShardedClient if SHARDING_ENABLED else discord.Client):
+    """ヘルスチェックサーバーを同じイベントループで動かし、終了時に共有HTTPセッションも閉じるDiscordクライアント"""
+
+    async def setup_hook(self):
+        # 翻訳ボタンはcustom_idで処理を選ぶ（再起動前のメッセージのボタンも動作し、メッセージごとのViewを保持しない）
+        self.add_dynamic_items(TranslateButton)
+        # Gateway接続前にヘルスチェックサーバーを起動
+        await health_server.start()
+        # イベントループ監視とハートビート（on_readyは再接続のたびに呼ばれるため、ここで1回だけ開始）
+        self.watchdog_task = asyncio.create_task(event_loop_watchdog.run())
+        self.heartbeat_task = asyncio.create_task(heartbeat.run())
+        print(f"🔄 {HEARTBEAT_INTERVAL}秒ごとのハートビートを開始します")
+
+    async def close(self):
+        await health_server.close()
+        await deepl_client.close()
+        if translation_cache.backend is not None:
+            await translation_cache.backend.close()
+        if message_store.backend is not None:
+            await message_store.backend.close()
+        if deepl_quota.shared is not None:
+            await deepl_quota.shared.close()
+        await super().close()
+
+
+client = TranslatorBotClient(intents=intents, **shard_options)
+
+# サーキットブレーカー設定（障害中のバックエンドを待たずにスキップする）
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))  # 連続失敗でオープン
+BREAKER_RECOVERY_TIMEOUT = float(os.getenv('BREAKER_RECOVERY_TIMEOUT', '30'))  # オープン後の確認間隔（秒）
+
+
+class BackendUnavailableError(Exception):
+    """サーキットブレーカーがオープンでバックエンドを呼び出さなかった"""
+
+
+class CircuitBreaker:
+    """翻訳バックエンドごとのサーキットブレーカー（closed / open / half_open）
+
+    - closed: 通常どおり呼び出す。failure_threshold 回連続で失敗したら open
+    - open: 呼び出さずに即座に失敗扱い。recovery_timeout 秒ごとにバックグラウンドで probe を実行し、
+      成功したら closed に戻す（probe がなければ half_open に移る）
+    - half_open: 1件だけ試しに呼び出し、成功なら closed、失敗なら再び open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD,
+                 recovery_timeout=BREAKER_RECOVERY_TIMEOUT, probe=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.probe = probe  # 回復確認用のコルーチン関数（Trueで回復）
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.rejected = 0
+        self.transitions = {}
+        self._trial_in_flight = False
+        self._probe_task = None
+
+    def _transition(self, new_state):
+        if new_state == self.state:
+            return
+        key = f"{self.state}->{new_state}"
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        print(f"🔌 サーキットブレーカー {self.name}: {self.state} → {new_state}")
+        self.state = new_state
+        self._trial_in_flight = False
+        if new_state == self.OPEN and (self._probe_task is None or self._probe_task.done()):
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        while self.state == self.OPEN:
+            await asyncio.sleep(self.recovery_timeout)
+            if self.state != self.OPEN:
+                return
+            if self.probe is None:
+                self._transition(self.HALF_OPEN)
+                return
+            try:
+                recovered = await self.probe()
+            except Exception:
+                recovered = False
+            if recovered:
+                self.consecutive_failures = 0
+                self._transition(self.CLOSED)
+                return
+
+    def allow_request(self):
+        """呼び出してよいか判定（open中、half_openで試行中なら拒否）"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def cancel_trial(self):
+        """half_openの試行を呼び出さずに終えた場合に、次の試行を許可する"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN:
+            self._transition(self.OPEN)
+        elif self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._transition(self.OPEN)
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout_seconds": self.recovery_timeout,
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions)
+        }
+
+
+# フォールバック翻訳器（GoogleTranslate）の設定
+GOOGLE_MAX_WORKERS = int(os.getenv('GOOGLE_MAX_WORKERS', '4'))  # 同時実行数の上限
+GOOGLE_TIMEOUT = float(os.getenv('GOOGLE_TIMEOUT', '8'))  # 1件あたりのタイムアウト（秒、待ち時間込み）
+
+
+class GoogleTranslatePool:
+    """googletrans（同期API）を専用スレッドプールで実行するフォールバック翻訳器
+
+    イベントループをブロックしないよう翻訳はワーカースレッドで行い、
+    同時実行数を max_workers に制限する。timeout 秒を超えた呼び出しは
+    asyncio.TimeoutError とし、スレッド側の処理が終わるまで枠は解放しない。
+    """
+
+    def __init__(self, max_workers=GOOGLE_MAX_WORKERS, timeout=GOOGLE_TIMEOUT, breaker=None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker("Google Translate")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="google-translate")
+        self._slots = asyncio.Semaphore(max_workers)
+        self._local = local()  # Translatorはスレッドごとに1つ作成
+        self.in_flight = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def _get_translator(self):
+        translator = getattr(self._local, "translator", None)
+        if translator is None:
+            from googletrans import Translator
+            translator = self._local.translator = Translator()
+        return translator
+
+    def _translate_sync(self, text, dest, src):
+        return self._get_translator().translate(text, dest=dest, src=src).text
+
+    async def warm_up(self):
+        """ワーカースレッドでgoogletransの読み込みとTranslator作成を済ませておく"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._get_translator)
+
+    def _release(self, future):
+        self.in_flight -= 1
+        self._slots.release()
+        if not future.cancelled():
+            # タイムアウトで待つのをやめた後に失敗した場合も例外を回収しておく
+            future.exception()
+
+    async def translate(self, text, dest, src="auto"):
+        """翻訳テキストを返す
+
+        タイムアウト時は asyncio.TimeoutError、ブレーカーがオープンなら BackendUnavailableError、
+        その他はgoogletransの例外を送出する
+        """
+        if not self.breaker.allow_request():
+            raise BackendUnavailableError("Google Translate は一時的に停止中です")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        self.calls += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            # 混雑による待ち時間切れはバックエンドの障害とはみなさない
+            self.timeouts += 1
+            self.breaker.cancel_trial()
+            raise
+        except asyncio.CancelledError:
+            # ヘッジで負けた側などの取り消しでhalf_openの試行枠を残さない
+            self.breaker.cancel_trial()
+            raise
+
+        self.in_flight += 1
+        future = loop.run_in_executor(self._executor, self._translate_sync, text, dest, src)
+        future.add_done_callback(self._release)
+        try:
+            # shieldでタイムアウト時もスレッド完了まで枠を保持する
+            translated_text = await asyncio.wait_for(asyncio.shield(future), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            self.breaker.cancel_trial()
+            raise
+        except Exception:
+            self.errors += 1
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return translated_text
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "timeout_seconds": self.timeout,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "errors": self.errors
+        }
+
+
+google_translator = GoogleTranslatePool()
+
+# ヘルスチェック用HTTPサーバー（Koyebのヘルスチェック・スリープ防止用）
+HEALTH_SERVER_PORT = int(os.environ.get('PORT', 8080))
+HEALTH_REFRESH_INTERVAL = float(os.getenv('HEALTH_REFRESH_INTERVAL', '5'))  # / と /health の内容を作り直す間隔（秒）
+
+
+def build_status():
+    """/ の内容"""
+    import psutil
+
+    return {
         "status": "ok",
         "message": "Discord Bot is running",
         "python_version": sys.version,
         "timestamp": datetime.now().isoformat(),
         "discord_bot_status": "connected" if client.is_ready() else "connecting",
-        "memory_usage_mb": round(memory_mb, 2),
-        "memory_percent": round(psutil.virtual_memory().percent, 2)
-    })
+        "memory_usage_mb": round(heartbeat.memory_mb(), 2),
+        "memory_percent": round(psutil.virtual_memory().percent, 2),
+        "deepl_quota": deepl_quota.stats()
+    }
 
-@app.route('/health')
-def health():
-    """追加のヘルスチェックエンドポイント"""
-    return jsonify({
+
+def build_health():
+    """/health の内容"""
+    return {
         "status": "healthy",
         "uptime": datetime.now().isoformat(),
-        "bot_ready": client.is_ready()
-    })
+        "bot_ready": client.is_ready(),
+        "startup_phases": startup_phases,
+        "translation_cache": translation_cache.stats(),
+        "deepl_batching": deepl_batcher.stats(),
+        "google_fallback": google_translator.stats(),
+        "language_detection": language_detection_info(),
+        "message_store": message_store.stats(),
+        "scheduler": translation_scheduler.stats(),
+        "deepl_quota": deepl_quota.stats(),
+        "pipeline": translation_pipeline.stats(),
+        "protected_spans": protected_span_info(),
+        "hedging": hedge_info(),
+        "button_edits": message_editor.stats(),
+        "outbound": outbound_packer.stats(),
+        "message_edits": message_edit_info(),
+        "event_loop": event_loop_watchdog.stats(),
+        "heartbeat": heartbeat.stats(),
+        "circuit_breakers": {
+            "deepl": deepl_breaker.stats(),
+            "google": google_translator.breaker.stats()
+        }
+    }
+
+
+class HealthServer:
+    """Botと同じイベントループで動くヘルスチェック用HTTPサーバー（aiohttp.web）
+
+    / と /health は作成済みのJSONを返し、refresh_interval 秒より古ければ作り直す。
+    別スレッドを使わないため、Botの状態を読むときのロックやGILの競合がない。
+    """
+
+    def __init__(self, port, refresh_interval):
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self.requests = 0
+        self._snapshots = {}  # path -> (作成時刻, JSONのバイト列)
+        self._builders = {"/": build_status, "/health": build_health}
+        self._runner = None
+
+    def _snapshot(self, path):
+        created_at, body = self._snapshots.get(path, (None, None))
+        now = time.monotonic()
+        if created_at is None or now - created_at >= self.refresh_interval:
+            body = json.dumps(self._builders[path](), ensure_ascii=False).encode("utf-8")
+            self._snapshots[path] = (now, body)
+        return body
+
+    async def _handle_snapshot(self, request):
+        """ヘルスチェック用エンドポイント（/ と /health）"""
+        self.requests += 1
+        return web.Response(body=self._snapshot(request.path), content_type="application/json")
+
+    async def _handle_metrics(self, request):
+        """Prometheus形式のメトリクス"""
+        self.requests += 1
+        return web.Response(body=metrics.render().encode("utf-8"),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def _handle_ping(self, request):
+        """シンプルなpingエンドポイント（スリープ防止用）"""
+        self.requests += 1
+        return web.Response(text="pong")
+
+    async def _handle_keepalive(self, request):
+        """Keep-alive専用エンドポイント"""
+        self.requests += 1
+        return web.json_response({"alive": True, "timestamp": datetime.now().isoformat()})
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get('/', self._handle_snapshot)
+        app.router.add_get('/health', self._handle_snapshot)
+        app.router.add_get('/metrics', self._handle_metrics)
+        app.router.add_get('/ping', self._handle_ping)
+        app.router.add_get('/keepalive', self._handle_keepalive)
+        return app
+
+    async def start(self):
+        """サーバーを起動（Gateway接続前に呼び、接続待ちの間もヘルスチェックに応答する）"""
+        if self._runner is not None:
+            return
+        self._runner = web.AppRunner(self.create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, '0.0.0.0', self.port).start()
+        record_startup_phase("health_server_started")
+        print(f"🌐 ヘルスチェックサーバーがポート{self.port}で起動しました")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+health_server = HealthServer(HEALTH_SERVER_PORT, HEALTH_REFRESH_INTERVAL)
+
+# プロセス内ハートビート（HTTPを使わずに状態を直接読み、直近の記録をリングバッファに保持）
+HEARTBEAT_INTERVAL = int(os.getenv('HEARTBEAT_INTERVAL', '240'))  # 秒
+HEARTBEAT_HISTORY = int(os.getenv('HEARTBEAT_HISTORY', '30'))  # 保持する記録の件数
+MEMORY_SOFT_LIMIT_MB = float(os.getenv('MEMORY_SOFT_LIMIT_MB', '400'))  # 超えたらキャッシュを縮小
+MEMORY_TRIM_FRACTION = 0.25  # 1回の縮小で削除する各キャッシュの割合
+MEMORY_TRIM_CHUNK = 500  # この件数ごとにイベントループへ処理を返す
+
+
+class Heartbeat:
+    """定期的にBotの状態を記録し、メモリ使用量が多い時は少しずつ解放する"""
+
+    def __init__(self, interval, history, memory_limit_mb):
+        self.interval = interval
+        self.memory_limit_mb = memory_limit_mb
+        self.samples = deque(maxlen=history)
+        self.trims = 0
+        self._process = None
+
+    def memory_mb(self):
+        if self._process is None:
+            import psutil
+            self._process = psutil.Process()
+        return self._process.memory_info().rss / 1024 / 1024
+
+    def sample(self):
+        """現在の状態を1件記録して返す"""
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "bot_ready": client.is_ready(),
+            "gateway_latency_ms": round(client.latency * 1000, 1) if client.is_ready() else None,
+            "shard_latency_ms": {
+                shard_id: round(latency * 1000, 1) for shard_id, latency in client.latencies
+            } if SHARDING_ENABLED and client.is_ready() else None,
+            "memory_mb": round(self.memory_mb(), 1),
+            "event_loop_lag_ms": round(event_loop_watchdog.current_lag * 1000, 1),
+            "queue_depth": translation_scheduler.queue_depth,
+            "in_flight": translation_scheduler.in_flight,
+            "translation_cache_entries": len(translation_cache),
+            "message_store_entries": len(message_store)
+        }
+        self.samples.append(record)
+        return record
+
+    async def relieve_memory_pressure(self):
+        """キャッシュの古いエントリを少しずつ削除し、若い世代のみGCする（全世代GCで止めない）
+
+        メッセージ保存はボタン翻訳に必要な元テキストの唯一の控えなので、ディスクから復元できる場合だけ削除する。
+        """
+        self.trims += 1
+        removed = 0
+        caches = [translation_cache]
+        if message_store.backend is not None:
+            caches.append(message_store)
+        for cache in caches:
+            remaining = int(len(cache) * MEMORY_TRIM_FRACTION)
+            while remaining > 0:
+                count = cache.trim(min(MEMORY_TRIM_CHUNK, remaining))
+                if count == 0:
+                    break
+                removed += count
+                remaining -= count
+                await asyncio.sleep(0)
+        gc.collect(1)
+        return removed
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                record = self.sample()
+                if record["memory_mb"] > self.memory_limit_mb:
+                    removed = await self.relieve_memory_pressure()
+                    print(f"🧹 メモリ {record['memory_mb']:.1f}MB - キャッシュを{removed}件削除 "
+                          f"→ {self.memory_mb():.1f}MB")
+                else:
+                    print(f"✅ ハートビート (メモリ: {record['memory_mb']:.1f}MB)")
+            except Exception as e:
+                print(f"❌ ハートビートエラー: {e}")
+
+    def stats(self):
+        return {
+            "interval_seconds": self.interval,
+            "memory_limit_mb": self.memory_limit_mb,
+            "trims": self.trims,
+            "samples": list(self.samples)
+        }
 
-@app.route('/ping')
-def ping():
-    """シンプルなpingエンドポイント（スリープ防止用）"""
-    return "pong"
 
-@app.route('/keepalive')
-def keepalive():
-    """Keep-alive専用エンドポイント"""
-    return jsonify({"alive": True, "timestamp": datetime.now().isoformat()})
+heartbeat = Heartbeat(HEARTBEAT_INTERVAL, HEARTBEAT_HISTORY, MEMORY_SOFT_LIMIT_MB)
 
-def run_flask():
-    port = int(os.environ.get('PORT', 8080))
-    app.run(host='0.0.0.0', port=port)
+# DeepL API設定
+DEEPL_API_URL = os.getenv('DEEPL_API_URL', "https://api-free.deepl.com/v2/translate")
+DEEPL_USAGE_URL = os.getenv('DEEPL_USAGE_URL', DEEPL_API_URL.rsplit("/translate", 1)[0] + "/usage")
+DEEPL_TIMEOUT = 10  # 秒
+DEEPL_MAX_CONNECTIONS = int(os.getenv('DEEPL_MAX_CONNECTIONS', '20'))  # 同時接続数の上限
+# マイクロバッチ設定（同時に来た翻訳を1回のAPI呼び出しにまとめる）
+DEEPL_BATCH_WINDOW_MS = float(os.getenv('DEEPL_BATCH_WINDOW_MS', '10'))  # 0でバッチ無効
+DEEPL_BATCH_MAX_TEXTS = 50  # DeepLの1リクエストあたりのtext数上限
+DEEPL_BATCH_MAX_BYTES = 120 * 1024  # DeepLのリクエストサイズ上限（128KiB）に余裕を持たせた値
+DEEPL_PLACEHOLDER_TAG = "x"  # 文中の翻訳しない部分の代わりに送るタグ（<x id="0"/>、ignore_tagsで翻訳させない）
+# レート制限と文字数枠の管理（使えない時はDeepLを呼ばずにGoogleへ）
+DEEPL_RATE_PER_SECOND = float(os.getenv('DEEPL_RATE_PER_SECOND', '10'))  # 1秒あたりのリクエスト数
+DEEPL_RATE_BURST = int(os.getenv('DEEPL_RATE_BURST', '20'))  # 瞬間的に許可するリクエスト数
+DEEPL_USAGE_POLL_INTERVAL = int(os.getenv('DEEPL_USAGE_POLL_INTERVAL', '600'))  # /v2/usage の確認間隔（秒）
+DEEPL_QUOTA_EXCEEDED_STATUS = 456  # DeepLの文字数枠切れのステータスコード
+
+
+class DeepLClient:
+    """DeepL API用の非同期HTTPクライアント（keep-alive接続プールを共有）"""
+
+    def __init__(self, api_url, usage_url, timeout=DEEPL_TIMEOUT, max_connections=DEEPL_MAX_CONNECTIONS):
+        self.api_url = api_url
+        self.usage_url = usage_url
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self._session = None
+
+    async def start(self):
+        """セッションを作成（on_readyで呼び出し、未作成なら初回リクエスト時にも作成）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
 
-async def periodic_health_check():
-    """4分ごとにセルフヘルスチェックとメモリ管理を実行（スリープ防止）"""
-    while True:
+    async def close(self):
+        """セッションを閉じる（Bot終了時）"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def translate(self, params):
+        """翻訳APIを呼び出し、(ステータスコード, レスポンスJSON) を返す
+
+        タイムアウト時は asyncio.TimeoutError、通信エラー時は aiohttp.ClientError を送出する
+        """
+        await self.start()
+        async with self._session.post(self.api_url, data=params) as response:
+            if response.status != 200:
+                return response.status, None
+            return response.status, await response.json(content_type=None)
+
+    async def usage(self):
+        """使用量APIを呼び出し、(ステータスコード, レスポンスJSON) を返す"""
+        await self.start()
+        async with self._session.post(self.usage_url, data={"auth_key": DEEPL_TOKEN}) as response:
+            if response.status != 200:
+                return response.status, None
+            return response.status, await response.json(content_type=None)
+
+
+class LatencyTracker:
+    """直近の応答時間を保持してパーセンタイルを計算する"""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, percent):
+        """指定パーセンタイルの応答時間（秒）。サンプルがなければNone"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(int(len(ordered) * percent / 100), len(ordered) - 1)
+        return ordered[index]
+
+
+class DeepLBatcher:
+    """同時に発生した翻訳を短時間溜めて、複数textの1リクエストにまとめる
+
+    (翻訳元言語, 翻訳先言語, タグの扱い) ごとにグループ化し、window秒経過するか
+    text数・リクエストサイズの上限に達した時点で送信する。
+    結果はそれぞれ待っているコルーチンに (ステータスコード, 翻訳テキスト) で返す。
+    """
+
+    def __init__(self, client, window, max_texts=DEEPL_BATCH_MAX_TEXTS, max_bytes=DEEPL_BATCH_MAX_BYTES,
+                 quota=None, breaker=None, latency_tracker=None):
+        self.client = client
+        self.latency_tracker = latency_tracker  # 成功時の応答時間の記録先（LatencyTracker、任意）
+        self.quota = quota  # 送信文字数の記録先（DeepLQuota、任意）
+        self.breaker = breaker  # 成功・失敗の記録先（CircuitBreaker、任意）
+        self.window = window
+        self.max_texts = max_texts
+        self.max_bytes = max_bytes
+        self._groups = {}  # (source_lang, target_lang, tag_handling) -> [(text, future), ...]
+        self._group_bytes = {}
+        self._timers = {}
+        self.requests_sent = 0
+        self.texts_sent = 0
+        self.largest_batch = 0
+
+    @staticmethod
+    def _encoded_size(text):
+        # フォーム送信時のURLエンコード後のサイズ（"&text=" を含む）
+        return len(quote_plus(text)) + 6
+
+    async def translate(self, text, target_lang, source_lang=None, tag_handling=None):
+        """1件の翻訳を依頼し、(ステータスコード, 翻訳テキスト or None) を返す
+
+        tag_handling="xml" ではプレースホルダータグ（DEEPL_PLACEHOLDER_TAG）を翻訳せずにそのまま返させる。
+        タイムアウト・通信エラーは DeepLClient.translate と同じ例外で送出する
+        """
+        if self.window <= 0:
+            return (await self._request((source_lang, target_lang, tag_handling), [text]))[0]
+
+        key = (source_lang, target_lang, tag_handling)
+        size = self._encoded_size(text)
+        if key in self._groups and self._group_bytes[key] + size > self.max_bytes:
+            self._flush(key)
+
+        future = asyncio.get_running_loop().create_future()
+        if key not in self._groups:
+            self._groups[key] = []
+            self._group_bytes[key] = 0
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        self._groups[key].append((text, future))
+        self._group_bytes[key] += size
+
+        if len(self._groups[key]) >= self.max_texts:
+            self._flush(key)
+        return await future
+
+    def has_open_batch(self, target_lang, source_lang=None, tag_handling=None):
+        """同じ言語ペアの送信待ちバッチがあるか（あれば新しいリクエストは発生しない）"""
+        return (source_lang, target_lang, tag_handling) in self._groups
+
+    def _flush(self, key):
+        items = self._groups.pop(key, None)
+        self._group_bytes.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if items:
+            asyncio.create_task(self._send(key, items))
+
+    async def _request(self, key, texts):
+        source_lang, target_lang, tag_handling = key
+        params = [("auth_key", DEEPL_TOKEN), ("target_lang", target_lang)]
+        if source_lang:
+            params.append(("source_lang", source_lang))
+        if tag_handling:
+            params.extend([("tag_handling", tag_handling), ("ignore_tags", DEEPL_PLACEHOLDER_TAG)])
+        params.extend(("text", text) for text in texts)
+
+        self.requests_sent += 1
+        self.texts_sent += len(texts)
+        self.largest_batch = max(self.largest_batch, len(texts))
+
+        started_at = time.monotonic()
         try:
-            await asyncio.sleep(240)  # 4分待機（5分制限より短く）
-            
-            # メモリ使用量チェック
-            process = psutil.Process()
-            memory_mb = process.memory_info().rss / 1024 / 1024
-            
-            port = int(os.environ.get('PORT', 8080))
-            # 複数のエンドポイントでヘルスチェック
-            endpoints = [f'http://localhost:{port}/', f'http://localhost:{port}/ping', f'http://localhost:{port}/keepalive']
-            success = False
-            
-            for endpoint in endpoints:
-                try:
-                    response = requests.get(endpoint, timeout=5)
-                    if response.status_code == 200:
-                        success = True
-                        break
-                except:
-                    continue
-            
-            if not success:
-                response = requests.get(f'http://localhost:{port}/', timeout=10)
-            
-            if response.status_code == 200:
-                print(f"✅ ヘルスチェック成功 (メモリ: {memory_mb:.1f}MB)")
-                
-                # メモリが400MB超過時にガベージコレクション実行
-                if memory_mb > 400:
-                    print("🧹 メモリクリーンアップ実行中...")
-                    gc.collect()
-                    new_memory = psutil.Process().memory_info().rss / 1024 / 1024
-                    print(f"🧹 クリーンアップ完了: {memory_mb:.1f}MB → {new_memory:.1f}MB")
-                    
+            status, response_json = await self.client.translate(params)
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+        if self.breaker is not None:
+            # 5xxは障害、それ以外（429・456など）はレート・枠の問題なのでDeepL自体は正常とみなす
+            if status >= 500:
+                self.breaker.record_failure()
             else:
-                print(f"⚠️ ヘルスチェック警告: ステータスコード {response.status_code}")
-                
+                self.breaker.record_success()
+        if self.quota is not None:
+            self.quota.record_response(status, sum(len(text) for text in texts))
+        if status == 200 and self.latency_tracker is not None:
+            self.latency_tracker.record(time.monotonic() - started_at)
+        if status != 200:
+            return [(status, None)] * len(texts)
+        return [(status, translation["text"]) for translation in response_json["translations"]]
+
+    async def _send(self, key, items):
+        texts = [text for text, _ in items]
+        try:
+            results = await self._request(key, texts)
         except Exception as e:
-            print(f"❌ ヘルスチェックエラー: {e}")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
 
-def keep_alive():
-    """Webサーバーを別スレッドで起動してbotを生存させる"""
-    server = Thread(target=run_flask)
-    server.daemon = True
-    server.start()
-    port = int(os.environ.get('PORT', 8080))
-    print(f"🌐 Keep-aliveサーバーがポート{port}で起動しました")
-    print("🔄 4分ごとのヘルスチェックを開始します（スリープ防止）")
+        for (_, future), result in zip(items, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "window_ms": self.window * 1000,
+            "requests_sent": self.requests_sent,
+            "texts_sent": self.texts_sent,
+            "average_batch_size": round(self.texts_sent / self.requests_sent, 2) if self.requests_sent else 0.0,
+            "largest_batch": self.largest_batch
+        }
 
-# DeepL API設定
-DEEPL_API_URL = "https://api-free.deepl.com/v2/translate"
+
+class TokenBucket:
+    """トークンバケット方式のレート制限（rate 個/秒で補充、最大 capacity 個）"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_acquire(self, tokens=1):
+        """トークンを取得できればTrue（待たずに判定）"""
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    @property
+    def available(self):
+        """現在のトークン数（状態は変更しないのでヘルスチェックのスレッドからも読める）"""
+        return min(self.capacity, self._tokens + (time.monotonic() - self._updated_at) * self.rate)
+
+
+class DeepLQuota:
+    """DeepLの文字数枠とリクエストレートをクライアント側で管理する
+
+    - 送信した文字数を数え、/v2/usage を定期的に確認して今期の使用量と上限を更新
+    - リクエストレートをトークンバケットで制限
+    - 枠切れ・バケットが空の場合は allow がFalseを返し、呼び出し側はDeepLを呼ばずにフォールバックする
+    """
+
+    def __init__(self, client, bucket, poll_interval=DEEPL_USAGE_POLL_INTERVAL, shared=None):
+        self.client = client
+        self.bucket = bucket
+        self.shared = shared  # 複数プロセスで使用量を共有する SharedQuotaStore（任意）
+        self.poll_interval = poll_interval
+        self.character_count = None  # 今期の使用文字数（/v2/usage の値）
+        self.character_limit = None  # 今期の上限文字数
+        self.characters_since_poll = 0
+        self.characters_sent = 0
+        self.exhausted = False
+        self.quota_skips = 0
+        self.throttled = 0
+        self.last_polled_at = None
+        self._poll_task = None
+
+    def remaining(self):
+        """残り文字数（まだ使用量を取得していなければNone）"""
+        if self.exhausted:
+            return 0
+        if self.shared is not None and self.shared.state is not None:
+            # 他のプロセスが送信した文字数も含めた共有の使用量
+            return self.shared.remaining()
+        if self.character_limit is None:
+            return None
+        return max(self.character_limit - self.character_count - self.characters_since_poll, 0)
+
+    def allow(self, text, target_lang, source_lang=None, tag_handling=None):
+        """このテキストをDeepLに送ってよいか判定"""
+        remaining = self.remaining()
+        if remaining is not None and remaining < len(text):
+            self.quota_skips += 1
+            return False
+        # 送信待ちのバッチに相乗りする場合は新しいリクエストにならないのでトークン不要
+        if deepl_batcher.has_open_batch(target_lang, source_lang, tag_handling):
+            return True
+        if not self.bucket.try_acquire():
+            self.throttled += 1
+            return False
+        return True
+
+    def record_response(self, status, characters):
+        """DeepLの応答を記録（成功時は文字数を加算、枠切れ応答なら次の確認まで停止）"""
+        if status == 200:
+            self.characters_since_poll += characters
+            self.characters_sent += characters
+            if self.shared is not None:
+                self.shared.add_characters(characters)
+        elif status == DEEPL_QUOTA_EXCEEDED_STATUS and not self.exhausted:
+            self.exhausted = True
+            if self.shared is not None:
+                self.shared.mark_exhausted()
+            print("⚠️ DeepLの文字数枠が上限に達しました - 次の使用量確認までGoogle Translateを使用します")
+
+    async def poll_usage(self):
+        """/v2/usage から今期の使用量を取得"""
+        try:
+            status, usage = await self.client.usage()
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            print(f"⚠️ DeepL使用量の取得に失敗しました: {e}")
+            return
+        if status != 200:
+            print(f"⚠️ DeepL使用量の取得に失敗しました（{status}）")
+            return
+
+        self.character_count = usage.get("character_count", 0)
+        self.character_limit = usage.get("character_limit")
+        self.characters_since_poll = 0
+        self.last_polled_at = datetime.now().isoformat()
+        # 請求期間が切り替わって枠が回復した場合は再開
+        self.exhausted = self.character_limit is not None and self.character_count >= self.character_limit
+        if self.shared is not None:
+            self.shared.record_usage(self.character_count, self.character_limit)
+
+    async def _poll_loop(self):
+        while True:
+            await self.poll_usage()
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        """使用量の定期確認を開始（on_readyで呼び出し）"""
+        if self._poll_task is None or self._poll_task.done():
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    def stats(self):
+        return {
+            "character_count": self.character_count,
+            "character_limit": self.character_limit,
+            "characters_remaining": self.remaining(),
+            "characters_sent": self.characters_sent,
+            "exhausted": self.exhausted,
+            "last_polled_at": self.last_polled_at,
+            "rate_per_second": self.bucket.rate,
+            "rate_burst": self.bucket.capacity,
+            "rate_tokens_available": round(self.bucket.available, 2),
+            "throttled": self.throttled,
+            "quota_skips": self.quota_skips,
+            "shared": self.shared.stats() if self.shared is not None else None
+        }
+
+
+async def probe_deepl():
+    """DeepLの回復確認（文字数を消費しない /v2/usage を呼び出す）"""
+    status, _ = await deepl_client.usage()
+    return status < 500
+
+
+# 全翻訳関数で共有するDeepLクライアント・文字数枠管理・サーキットブレーカー・バッチ処理
+deepl_client = DeepLClient(DEEPL_API_URL, DEEPL_USAGE_URL)
+# シャードを複数プロセスに分けた場合は、レート上限を担当シャード数の割合で分け合う
+deepl_quota = DeepLQuota(deepl_client, TokenBucket(DEEPL_RATE_PER_SECOND * SHARD_RATE_SHARE,
+                                                   max(int(DEEPL_RATE_BURST * SHARD_RATE_SHARE), 1)))
+deepl_breaker = CircuitBreaker("DeepL", probe=probe_deepl)
+deepl_latency = LatencyTracker()
+deepl_batcher = DeepLBatcher(deepl_client, window=DEEPL_BATCH_WINDOW_MS / 1000,
+                             quota=deepl_quota, breaker=deepl_breaker, latency_tracker=deepl_latency)
+
+
+def can_use_deepl(text, target_lang, source_lang=None, tag_handling=None):
+    """DeepLを呼び出してよいか（ブレーカーがclosed、かつ文字数枠・レートに余裕がある）"""
+    return deepl_breaker.allow_request() and deepl_quota.allow(text, target_lang, source_lang, tag_handling)
 
 # DeepLがサポートする言語コードのマッピング
 DEEPL_SUPPORTED_LANGS = {
@@ -180,37 +1176,806 @@ DEEPL_SUPPORTED_LANGS = {
     'tr': 'tr'
 }
 
-# 言語判別関数（エラーハンドリング追加）
-def detect_language(text):
+# 言語判別の設定
+DetectorFactory.seed = 0  # langdetectの結果を決定的にする（短文で判定が揺れないように）
+LANGUAGE_DETECTION_CACHE_SIZE = int(os.getenv('LANGUAGE_DETECTION_CACHE_SIZE', '4096'))
+
+# 言語判別の邪魔になるDiscordのメンション・カスタム絵文字・URL
+DETECTION_NOISE_PATTERN = re.compile(r"<a?:\w+:\d+>|<(?:@[!&]?|#)\d+>|https?://\S+")
+
+# 言語判別の内訳（文字種で判定した件数 / langdetectを使った件数）
+language_detection_stats = {"script": 0, "statistical": 0}
+
+
+def _is_hangul(cp):
+    return (0xAC00 <= cp <= 0xD7A3 or 0x1100 <= cp <= 0x11FF or 0x3130 <= cp <= 0x318F
+            or 0xA960 <= cp <= 0xA97F or 0xD7B0 <= cp <= 0xD7FF)
+
+
+def _is_kana(cp):
+    return 0x3040 <= cp <= 0x30FF or 0x31F0 <= cp <= 0x31FF or 0xFF66 <= cp <= 0xFF9F
+
+
+def _is_han(cp):
+    return (0x4E00 <= cp <= 0x9FFF or 0x3400 <= cp <= 0x4DBF or 0xF900 <= cp <= 0xFAFF
+            or 0x20000 <= cp <= 0x2FA1F)
+
+
+def detect_language_by_script(text):
+    """文字種（ハングル・かな・漢字）を1パスで数えて言語を判定
+
+    判定できない場合（ラテン文字・キリル文字が主体の文）は None を返す。
+    """
+    hangul = kana = han = letters = 0
+    for ch in text:
+        cp = ord(ch)
+        if cp < 0x1100:
+            if ch.isalpha():
+                letters += 1
+        elif _is_hangul(cp):
+            hangul += 1
+        elif _is_kana(cp):
+            kana += 1
+        elif _is_han(cp):
+            han += 1
+        elif ch.isalpha():
+            letters += 1
+
+    cjk = hangul + kana + han
+    if cjk == 0:
+        # 文字を含まない（絵文字・数字・記号のみ）場合はデフォルトの英語
+        return "en" if letters == 0 else None
+    if cjk * 3 < letters:
+        # ラテン文字主体の文に少しだけCJK文字が混ざっている
+        return None
+    if hangul and hangul >= kana:
+        return "ko"
+    if kana:
+        return "ja"
+    return "zh"
+
+
+@lru_cache(maxsize=LANGUAGE_DETECTION_CACHE_SIZE)
+def _detect_normalized_language(normalized_text):
+    normalized_text = DETECTION_NOISE_PATTERN.sub(" ", normalized_text)
+    lang = detect_language_by_script(normalized_text)
+    if lang is not None:
+        language_detection_stats["script"] += 1
+        return lang
+
+    language_detection_stats["statistical"] += 1
     try:
-        lang = detect(text)
-        # DeepLがサポートする言語にマッピング
-        return DEEPL_SUPPORTED_LANGS.get(lang, "en")
+        lang = detect(normalized_text)
     except LangDetectException:
         # 言語判別に失敗した場合はデフォルトで英語として扱う
         return "en"
+    # zh-cn / zh-tw などは基本の言語コードにまとめてDeepLがサポートする言語にマッピング
+    return DEEPL_SUPPORTED_LANGS.get(lang.split("-")[0], "en")
+
+
+# 言語判別関数（文字種による高速判定 + langdetectフォールバック、結果はメモ化）
+def detect_language(text):
+    with detection_seconds.time():
+        return _detect_normalized_language(normalize_text(text))
+
+
+def language_detection_info():
+    cache_info = _detect_normalized_language.cache_info()
+    return {
+        **language_detection_stats,
+        "cache_hits": cache_info.hits,
+        "cache_misses": cache_info.misses,
+        "cache_size": cache_info.currsize
+    }
+
+# 翻訳キャッシュ設定（同じ文言の再翻訳でDeepLの文字数枠を消費しないため）
+TRANSLATION_CACHE_MAX_ENTRIES = int(os.getenv('TRANSLATION_CACHE_MAX_ENTRIES', '5000'))
+TRANSLATION_CACHE_MAX_MB = float(os.getenv('TRANSLATION_CACHE_MAX_MB', '16'))
+TRANSLATION_CACHE_TTL = int(os.getenv('TRANSLATION_CACHE_TTL', '86400'))  # 秒（デフォルト24時間）
+# 永続キャッシュ（SQLiteファイルのパス。未設定なら無効）
+TRANSLATION_CACHE_DB = os.getenv('TRANSLATION_CACHE_DB', '')
+TRANSLATION_CACHE_DB_MAX_ROWS = int(os.getenv('TRANSLATION_CACHE_DB_MAX_ROWS', '100000'))
+TRANSLATION_CACHE_DB_TTL = int(os.getenv('TRANSLATION_CACHE_DB_TTL', str(30 * 86400)))  # 秒（デフォルト30日）
+
+
+def normalize_text(text):
+    """キャッシュキー用にテキストを正規化（Unicode正規化 + 空白の統一）"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class TranslationCache:
+    """件数・メモリ量上限とTTL付きのLRU翻訳キャッシュ
+
+    キーは (正規化テキスト, 翻訳元言語, 翻訳先言語)。成功した翻訳結果のみ保存する。
+    """
+
+    # 1エントリあたりの固定オーバーヘッド（dict・タプル等）の概算バイト数
+    ENTRY_OVERHEAD_BYTES = 400
+
+    def __init__(self, max_entries, max_bytes, ttl, backend=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend  # 永続キャッシュ（PersistentTranslationStore、任意）
+        self._entries = OrderedDict()  # key -> (有効期限, 推定サイズ, 結果)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(text, source_lang, target_lang):
+        return (normalize_text(text), (source_lang or "").lower(), target_lang.upper())
+
+    def _estimate_size(self, key, result):
+        return (len(key[0].encode("utf-8"))
+                + len(result.get("translated_text", "").encode("utf-8"))
+                + self.ENTRY_OVERHEAD_BYTES)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, key):
+        """キャッシュを検索（見つからない・期限切れの場合はNone）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, _, result = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(result)
+
+    async def lookup(self, key):
+        """メモリ → 永続キャッシュの順に検索（永続キャッシュのヒットはメモリにも載せる）"""
+        result = self.get(key)
+        if result is not None or self.backend is None:
+            return result
+
+        result = await self.backend.get(key)
+        if result is not None:
+            self.put(key, result)
+        return result
+
+    def put(self, key, result):
+        """翻訳結果を保存し、上限を超えた分を古い順に削除"""
+        if self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._remove(key)
+
+        size = self._estimate_size(key, result)
+        self._entries[key] = (time.monotonic() + self.ttl, size, dict(result))
+        self._bytes += size
+
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def trim(self, count):
+        """古い順に最大 count 件を削除して削除件数を返す（永続キャッシュには残る）"""
+        removed = 0
+        while self._entries and removed < count:
+            self._remove(next(iter(self._entries)))
+            removed += 1
+        self.evictions += removed
+        return removed
+
+    def remember(self, key, result):
+        """成功した結果をキャッシュに保存してそのまま返す"""
+        if result.get("success"):
+            self.put(key, result)
+            if self.backend is not None:
+                self.backend.put(key, result)
+        return result
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "memory_bytes": self._bytes,
+            "max_memory_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+        if self.backend is not None:
+            stats["persistent"] = self.backend.stats()
+        return stats
+
+
+class SQLiteStore:
+    """専用スレッドで動くSQLite（WALモード）ストアの共通部分
+
+    - DB操作はすべて専用スレッド1本で行い、イベントループはfsyncを待たない
+    - 書き込みはメモリに溜めて flush_interval 秒ごとにまとめて1トランザクションで反映
+    - 起動時はファイルを読み込まず、開き終わるまでの検索は単にミス扱い（コールドスタート短縮）
+    - compact_interval 秒ごとに _compact で古い行を削除して容量を抑える
+
+    サブクラスは SCHEMA・_take_pending・_write_batch・_compact を実装する。
+    """
+
+    SCHEMA = ""
+
+    def __init__(self, path, flush_interval=2.0, compact_interval=600):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.compact_interval = compact_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"{type(self).__name__}-db")
+        self._conn = None
+        self._open_future = None
+        self._flush_task = None
+        self._last_compaction = time.monotonic()
+        self.rows_written = 0
+        self.flushes = 0
+        self.rows_compacted = 0
+        self.errors = 0
+
+    # --- DBスレッドで実行される処理 ---
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")  # 複数プロセスで同じファイルを使う場合の書き込み待ち
+        conn.executescript(self.SCHEMA)
+        conn.commit()
+        self._conn = conn
+
+    def _take_pending(self):
+        """未書き込みのデータを取り出す（なければNone）"""
+        raise NotImplementedError
+
+    def _write_batch(self, batch):
+        """取り出したデータを書き込み、書き込んだ行数を返す"""
+        raise NotImplementedError
+
+    def _compact(self):
+        """古い行を削除し、削除した行数を返す"""
+        raise NotImplementedError
+
+    def _compact_and_vacuum(self):
+        removed = self._compact()
+        if removed:
+            self._conn.execute("PRAGMA incremental_vacuum")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+            self._conn = None
+
+    # --- イベントループ側の処理 ---
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def start(self):
+        """バックグラウンドでDBを開き、定期書き込みを開始（待たずに戻る）"""
+        if self._open_future is None:
+            self._open_future = asyncio.ensure_future(self._run(self._open))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def _is_open(self):
+        return (self._open_future is not None and self._open_future.done()
+                and not self._open_future.cancelled() and self._open_future.exception() is None)
+
+    async def wait_until_open(self):
+        """DBのオープン完了を待つ（未開始・失敗時は即座に戻る）"""
+        if self._open_future is not None and not self._open_future.done():
+            try:
+                await asyncio.shield(self._open_future)
+            except sqlite3.Error:
+                pass
+
+    async def _query(self, func, *args):
+        """DBスレッドで読み込みを実行（未オープン・エラー時はNone）"""
+        if not self._is_open():
+            return None
+        try:
+            return await self._run(func, *args)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"⚠️ {self.path} 読み込みエラー: {e}")
+            return None
+
+    async def flush(self):
+        if not self._is_open():
+            return
+        batch = self._take_pending()
+        if batch is None:
+            return
+        try:
+            self.rows_written += await self._run(self._write_batch, batch)
+            self.flushes += 1
+            if time.monotonic() - self._last_compaction >= self.compact_interval:
+                self._last_compaction = time.monotonic()
+                self.rows_compacted += await self._run(self._compact_and_vacuum)
+        except sqlite3.Error as e:
+            self.errors += 1
+            print(f"⚠️ {self.path} 書き込みエラー: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def close(self):
+        """未書き込み分を反映してDBを閉じる（Bot終了時）"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self._open_future is not None:
+            try:
+                await self._open_future
+            except sqlite3.Error:
+                pass
+            await self.flush()
+            await self._run(self._close)
+            self._open_future = None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "loaded": self._is_open(),
+            "rows_written": self.rows_written,
+            "flushes": self.flushes,
+            "rows_compacted": self.rows_compacted,
+            "errors": self.errors
+        }
+
+
+class PersistentTranslationStore(SQLiteStore):
+    """SQLiteによる永続翻訳キャッシュ（再デプロイ後もDeepL枠を節約）
+
+    期限切れ行の削除と、max_rows を超えた分を最終利用が古い順に削除して容量を抑える。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS translations (
+            text TEXT NOT NULL,
+            source_lang TEXT NOT NULL,
+            target_lang TEXT NOT NULL,
+            translated_text TEXT NOT NULL,
+            service TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (text, source_lang, target_lang)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations(last_used);
+    """
+
+    def __init__(self, path, max_rows, ttl, **kwargs):
+        super().__init__(path, **kwargs)
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._pending = {}  # 未書き込みの結果 key -> result
+        self._touched = set()  # 最終利用時刻を更新するキー
+        self.hits = 0
+        self.misses = 0
+
+    # --- DBスレッドで実行される処理 ---
+    def _select(self, key):
+        row = self._conn.execute(
+            "SELECT translated_text, service, created_at FROM translations "
+            "WHERE text = ? AND source_lang = ? AND target_lang = ?",
+            key
+        ).fetchone()
+        if row is None or row[2] < time.time() - self.ttl:
+            return None
+        return row
+
+    def _take_pending(self):
+        if not (self._pending or self._touched):
+            return None
+        batch = (self._pending, self._touched)
+        self._pending, self._touched = {}, set()
+        return batch
+
+    def _write_batch(self, batch):
+        pending, touched = batch
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*key, result["translated_text"], result.get("service", ""), now, now)
+                 for key, result in pending.items()]
+            )
+            self._conn.executemany(
+                "UPDATE translations SET last_used = ? WHERE text = ? AND source_lang = ? AND target_lang = ?",
+                [(now, *key) for key in touched]
+            )
+        return len(pending)
+
+    def _compact(self):
+        removed = 0
+        with self._conn:
+            removed += self._conn.execute(
+                "DELETE FROM translations WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+            row_count = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            if row_count > self.max_rows:
+                removed += self._conn.execute(
+                    "DELETE FROM translations WHERE (text, source_lang, target_lang) IN ("
+                    "SELECT text, source_lang, target_lang FROM translations ORDER BY last_used LIMIT ?)",
+                    (row_count - self.max_rows,)
+                ).rowcount
+        return removed
+
+    # --- イベントループ側の処理 ---
+    async def get(self, key):
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return dict(pending)
+
+        row = await self._query(self._select, key)
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.add(key)
+        return {
+            "success": True,
+            "translated_text": row[0],
+            "source_lang": key[1],
+            "target_lang": key[2],
+            "service": row[1]
+        }
+
+    def put(self, key, result):
+        """書き込み予約（実際の書き込みは次回flush時）"""
+        self._pending[key] = dict(result)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "max_rows": self.max_rows,
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_writes": len(self._pending)
+        }
+
+
+# 自動翻訳と日本語・英語ボタンで共有する翻訳キャッシュ（永続キャッシュは任意）
+translation_cache = TranslationCache(
+    max_entries=TRANSLATION_CACHE_MAX_ENTRIES,
+    max_bytes=int(TRANSLATION_CACHE_MAX_MB * 1024 * 1024),
+    ttl=TRANSLATION_CACHE_TTL,
+    backend=PersistentTranslationStore(
+        TRANSLATION_CACHE_DB,
+        max_rows=TRANSLATION_CACHE_DB_MAX_ROWS,
+        ttl=TRANSLATION_CACHE_DB_TTL
+    ) if TRANSLATION_CACHE_DB else None
+)
+
+# ボタン翻訳用の元テキスト保存設定（再起動後も古いメッセージのボタンで翻訳できるように）
+MESSAGE_STORE_MAX_ENTRIES = int(os.getenv('MESSAGE_STORE_MAX_ENTRIES', '10000'))
+MESSAGE_STORE_DB = os.getenv('MESSAGE_STORE_DB', '')  # SQLiteファイルのパス（未設定ならメモリのみ）
+MESSAGE_STORE_DB_MAX_ROWS = int(os.getenv('MESSAGE_STORE_DB_MAX_ROWS', '200000'))
+
+
+class PersistentMessageStore(SQLiteStore):
+    """SQLiteによるメッセージID → 元テキストの永続保存（max_rows を超えた分は最終利用が古い順に削除）"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id INTEGER PRIMARY KEY,
+            original_text TEXT NOT NULL,
+            source_lang TEXT NOT NULL,
+            translations TEXT NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_last_used ON messages(last_used);
+    """
+
+    def __init__(self, path, max_rows, **kwargs):
+        super().__init__(path, **kwargs)
+        self.max_rows = max_rows
+        self._pending = {}  # 未書き込みのエントリ message_id -> entry
+
+    # --- DBスレッドで実行される処理 ---
+    def _select(self, message_id):
+        row = self._conn.execute(
+            "SELECT original_text, source_lang, translations FROM messages WHERE message_id = ?",
+            (message_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"original_text": row[0], "source_lang": row[1], "translations": json.loads(row[2])}
+
+    def _take_pending(self):
+        if not self._pending:
+            return None
+        batch, self._pending = self._pending, {}
+        return batch
+
+    def _write_batch(self, batch):
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)",
+                [(message_id, entry["original_text"], entry["source_lang"],
+                  json.dumps(entry["translations"], ensure_ascii=False), now)
+                 for message_id, entry in batch.items()]
+            )
+        return len(batch)
+
+    def _compact(self):
+        with self._conn:
+            row_count = self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+            if row_count <= self.max_rows:
+                return 0
+            return self._conn.execute(
+                "DELETE FROM messages WHERE message_id IN ("
+                "SELECT message_id FROM messages ORDER BY last_used LIMIT ?)",
+                (row_count - self.max_rows,)
+            ).rowcount
+
+    # --- イベントループ側の処理 ---
+    async def get(self, message_id):
+        pending = self._pending.get(message_id)
+        if pending is not None:
+            return pending
+        # ボタンクリックは頻度が低いので、起動直後はDBが開くのを待ってから検索する
+        await self.wait_until_open()
+        return await self._query(self._select, message_id)
+
+    def put(self, message_id, entry):
+        """書き込み予約（実際の書き込みは次回flush時）"""
+        self._pending[message_id] = {**entry, "translations": dict(entry["translations"])}
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "max_rows": self.max_rows,
+            "pending_writes": len(self._pending)
+        }
+
+
+class MessageTextStore:
+    """Botの翻訳メッセージID → 元のテキスト・翻訳元言語・ボタン翻訳結果 の対応表
+
+    メモリ上は件数上限付きのLRU。backend を指定すると再起動後もディスクから復元できる。
+    日本語・英語ボタンの翻訳結果もエントリに保存し、同じボタンの再クリックではAPIを呼ばない。
+    """
+
+    def __init__(self, max_entries, backend=None):
+        self.max_entries = max_entries
+        self.backend = backend  # PersistentMessageStore（任意）
+        self._entries = OrderedDict()  # message_id -> {"original_text", "source_lang", "translations"}
+        self.hits = 0
+        self.backend_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _put(self, message_id, entry):
+        self._entries[message_id] = entry
+        self._entries.move_to_end(message_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def remember(self, message_id, original_text, source_lang):
+        """翻訳メッセージ送信時に元のテキストを保存"""
+        entry = {"original_text": original_text, "source_lang": source_lang, "translations": {}}
+        self._put(message_id, entry)
+        if self.backend is not None:
+            self.backend.put(message_id, entry)
+
+    async def get(self, message_id):
+        """エントリを返す（見つからなければNone）"""
+        entry = self._entries.get(message_id)
+        if entry is not None:
+            self._entries.move_to_end(message_id)
+            self.hits += 1
+            return entry
+
+        if self.backend is not None:
+            entry = await self.backend.get(message_id)
+            if entry is not None:
+                self._put(message_id, entry)
+                self.backend_hits += 1
+                return entry
+
+        self.misses += 1
+        return None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def trim(self, count):
+        """古い順に最大 count 件をメモリから削除して削除件数を返す（backend がなければボタン翻訳できなくなる）"""
+        removed = 0
+        while self._entries and removed < count:
+            self._entries.popitem(last=False)
+            removed += 1
+        self.evictions += removed
+        return removed
+
+    def add_translation(self, message_id, target_lang, translated_text):
+        """ボタン翻訳の結果をエントリに保存"""
+        entry = self._entries.get(message_id)
+        if entry is None:
+            return
+        entry["translations"][target_lang] = translated_text
+        if self.backend is not None:
+            self.backend.put(message_id, entry)
+
+    def stats(self):
+        stats = {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "backend_hits": self.backend_hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+        if self.backend is not None:
+            stats["persistent"] = self.backend.stats()
+        return stats
+
+
+message_store = MessageTextStore(
+    max_entries=MESSAGE_STORE_MAX_ENTRIES,
+    backend=PersistentMessageStore(
+        MESSAGE_STORE_DB,
+        max_rows=MESSAGE_STORE_DB_MAX_ROWS
+    ) if MESSAGE_STORE_DB else None
+)
+
+# DeepL使用量の共有（シャードを複数プロセスに分けた場合に文字数枠を全プロセスで数える）
+DEEPL_QUOTA_DB = os.getenv('DEEPL_QUOTA_DB', '')  # SQLiteファイルのパス（未設定なら共有しない）
+
+
+class SharedQuotaStore(SQLiteStore):
+    """複数プロセスでDeepLの使用量を共有するSQLiteストア
+
+    各プロセスは送信した文字数を flush_interval 秒ごとに加算し、同時に全体の値を読み直す。
+    /v2/usage の結果を書き込んだプロセスが前回確認以降の加算分をリセットする。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS deepl_quota (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            character_count INTEGER,
+            character_limit INTEGER,
+            characters_since_poll INTEGER NOT NULL DEFAULT 0,
+            exhausted INTEGER NOT NULL DEFAULT 0,
+            updated_at REAL
+        );
+        INSERT OR IGNORE INTO deepl_quota (id) VALUES (1);
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.state = None  # 最後に読んだ (character_count, character_limit, characters_since_poll, exhausted)
+        self._characters = 0  # 未書き込みの送信文字数
+        self._exhausted = False
+        self._usage = None  # 未書き込みの /v2/usage の結果
+
+    def add_characters(self, characters):
+        self._characters += characters
+
+    def mark_exhausted(self):
+        self._exhausted = True
+
+    def record_usage(self, character_count, character_limit):
+        self._usage = (character_count, character_limit)
+
+    def remaining(self):
+        """全プロセス分の残り文字数（共有の値をまだ読んでいなければNone）"""
+        if self.state is None:
+            return None
+        character_count, character_limit, characters_since_poll, exhausted = self.state
+        if exhausted:
+            return 0
+        if character_limit is None:
+            return None
+        return max(character_limit - character_count - characters_since_poll - self._characters, 0)
+
+    # --- DBスレッドで実行される処理 ---
+    def _take_pending(self):
+        # 書き込むものがなくても他のプロセスの値を読むために毎回実行する
+        batch = (self._characters, self._exhausted, self._usage)
+        self._characters, self._exhausted, self._usage = 0, False, None
+        return batch
+
+    def _write_batch(self, batch):
+        characters, exhausted, usage = batch
+        with self._conn:
+            if usage is not None:
+                character_count, character_limit = usage
+                self._conn.execute(
+                    "UPDATE deepl_quota SET character_count = ?, character_limit = ?, characters_since_poll = 0, "
+                    "exhausted = ?, updated_at = ? WHERE id = 1",
+                    (character_count, character_limit,
+                     int(character_limit is not None and character_count >= character_limit), time.time())
+                )
+            if characters or exhausted:
+                self._conn.execute(
+                    "UPDATE deepl_quota SET characters_since_poll = characters_since_poll + ?, "
+                    "exhausted = MAX(exhausted, ?), updated_at = ? WHERE id = 1",
+                    (characters, int(exhausted), time.time())
+                )
+        row = self._conn.execute(
+            "SELECT character_count, character_limit, characters_since_poll, exhausted FROM deepl_quota WHERE id = 1"
+        ).fetchone()
+        self.state = (row[0] or 0, row[1], row[2], bool(row[3]))
+        return int(usage is not None) + int(bool(characters or exhausted))
+
+    def _compact(self):
+        return 0
+
+    def stats(self):
+        stats = super().stats()
+        stats["characters_remaining"] = self.remaining()
+        stats["exhausted"] = bool(self.state and self.state[3])
+        return stats
+
+
+# 共有先が指定されていれば文字数枠の管理に使う（DeepLQuotaより後に定義されるためここで設定）
+deepl_quota.shared = SharedQuotaStore(DEEPL_QUOTA_DB) if DEEPL_QUOTA_DB else None
+
+# DeepLとGoogle Translateで言語コードが異なるもの（その他は小文字にするだけ）
+GOOGLE_TARGET_LANGS = {
+    "ZH-HANT": "zh-tw",  # Google Translateでは繁体字はzh-tw
+    "ZH-HANS": "zh-cn",
+    "ZH": "zh-cn",
+    "EN-US": "en",
+    "EN-GB": "en",
+    "PT-BR": "pt",
+    "PT-PT": "pt",
+}
+# 翻訳元（言語判別結果）の変換。googletransは "zh" を受け付けない（zh-cn / zh-tw のみ）
+GOOGLE_SOURCE_LANGS = {
+    "zh": "zh-cn",
+    "zh-hans": "zh-cn",
+    "zh-hant": "zh-tw",
+}
 
 # Google Translate フォールバック関数
 async def translate_with_google(text, source_lang, target_lang):
     """Google Translateを使用した翻訳関数"""
     try:
-        # Google Translateの言語コード変換（中国語繁体字 ↔ 韓国語）
-        if target_lang == "KO":
-            google_target = "ko"
-        elif target_lang == "ZH-HANT":
-            google_target = "zh-tw"  # Google Translateでは繁体字はzh-tw
-        else:
-            google_target = "ko"
+        # DeepLの言語コードをGoogle Translateの言語コードに変換
+        google_target = GOOGLE_TARGET_LANGS.get(target_lang, target_lang.lower())
+        google_source = GOOGLE_SOURCE_LANGS.get(source_lang.lower(), source_lang.lower())
+
+        translated_text = await google_translator.translate(text, dest=google_target, src=google_source)
 
-        result = google_translator.translate(text, dest=google_target, src=source_lang)
-        
         return {
             "success": True,
-            "translated_text": result.text,
+            "translated_text": translated_text,
             "source_lang": source_lang,
             "target_lang": target_lang,
             "service": "Google Translate"
         }
+    except asyncio.TimeoutError:
+        return {
+            "success": False,
+            "error": f"Google Translate タイムアウト（{google_translator.timeout}秒）",
+            "service": "Google Translate"
+        }
     except Exception as e:
         return {
             "success": False,
@@ -218,296 +1983,1293 @@ async def translate_with_google(text, source_lang, target_lang):
             "service": "Google Translate"
         }
 
-# 翻訳関数（DeepL + フォールバック対応）
-async def translate_text(text, source_lang=None):
-    """DeepLとGoogle Translateフォールバック対応翻訳関数"""
-    try:
-        # 言語を自動判定
-        if not source_lang:
-            detected_lang = detect_language(text)
+# 翻訳パイプライン（正規化 → 言語判別 → キャッシュ → レート制限 → バックエンド → 後処理）
+class TranslationRequest:
+    """パイプラインの各段階で共有する1件の翻訳リクエスト"""
+
+    def __init__(self, text, target_lang=None, source_lang=None, is_segment=False, protected_parts=None,
+                 by_sentence=False):
+        self.text = text
+        self.is_segment = is_segment  # 翻訳しない部分で区切られたメッセージの一部
+        self.by_sentence = by_sentence  # 文ごとに翻訳・キャッシュする（自動翻訳するメッセージと編集されたメッセージ）
+        # 文中に翻訳しない部分がある場合の [(翻訳しない部分か, 文字列), ...]（バックエンドが元の位置に戻す）
+        self.protected_parts = protected_parts
+        self.target_lang = target_lang.upper() if target_lang else None  # Noneなら言語判別結果から決める
+        self.source_lang = source_lang
+        self.normalized_text = None
+        self.detected_lang = None
+        self.deepl_source = None
+        self.cache_key = None
+        self.cache_hit = False
+        self.coalesced = False  # 同時に実行中だった同じ翻訳の結果を共有した
+        self.segmented = False  # 翻訳しない部分を除いて部分ごとに翻訳した（文字数は各部分で記録済み）
+        self.use_deepl = True
+        self.result = None  # 段階で結果が決まった場合は以降の段階・バックエンドを飛ばす
+
+
+def auto_target_lang(detected_lang):
+    """自動翻訳の翻訳先言語を決定（中国語繁体字 ↔ 韓国語）"""
+    if detected_lang in ("zh", "zh-tw", "zh-hant"):
+        return "KO"  # 中国語 → 韓国語
+    if detected_lang == "ko":
+        return "ZH-HANT"  # 韓国語 → 中国語繁体字
+    # その他の言語は韓国語に翻訳
+    return "KO"
+
+
+# 翻訳しない部分（メンション・カスタム絵文字・URL・コード・繰り返し記号）
+# これらは翻訳APIに送らず、前後のテキストだけを翻訳して元の位置に戻す
+PROTECTED_SPAN_PATTERN = re.compile(
+    r"```.*?```"                    # コードブロック
+    r"|`[^`\n]+`"                   # インラインコード
+    r"|<a?:\w+:\d+>"                # カスタム絵文字
+    r"|<(?:@[!&]?|#)\d+>"           # ユーザー・ロール・チャンネルのメンション
+    r"|<t:\d+(?::[tTdDfFR])?>"      # タイムスタンプ
+    r"|https?://\S+"                # URL
+    r"|([^\w\s]|[ㅋㅎㅠㅜw])\1{3,}",  # 繰り返し記号・笑い（！！！！、ㅋㅋㅋㅋ など）
+    re.DOTALL
+)
+
+# 文字数削減の内訳（元の文字数 / 翻訳APIに送る文字数 / 翻訳不要で省略した件数 / 文ごとに分けて翻訳した件数）
+protected_span_stats = {"characters_in": 0, "characters_out": 0, "segmented": 0, "skipped": 0, "sentence_split": 0}
+
+# 自動翻訳するメッセージは文ごとに翻訳してキャッシュする（編集されたら変わった文だけ翻訳し直す）
+# 文をまたいだ文脈は訳に使われなくなるため、false で全体をまとめて翻訳する。ボタン翻訳は常に全体をまとめて翻訳する
+SENTENCE_SEGMENTS = os.getenv('SENTENCE_SEGMENTS', 'true').lower() in ('1', 'true', 'yes')
+SENTENCE_BOUNDARY_PATTERN = re.compile(
+    r"((?<=[.!?])\s+"                       # 英語・韓国語などの文末記号と空白
+    r"|(?<=[。！？…])(?![。！？…」』）)])\s*"  # 中国語・日本語の文末記号（続く記号・閉じ括弧は同じ文）
+    r"|\s*\n\s*)"                           # 改行
+)
+
+
+def split_protected_spans(text):
+    """テキストを (翻訳するか, 部分文字列) のリストに分割
+
+    翻訳する部分は前後の空白を除き、空白・記号だけの部分は翻訳しない。
+    """
+    segments = []
+    position = 0
+    for match in PROTECTED_SPAN_PATTERN.finditer(text):
+        segments.extend(_split_translatable(text[position:match.start()]))
+        segments.append((False, match.group(0)))
+        position = match.end()
+    segments.extend(_split_translatable(text[position:]))
+    return segments
+
+
+def _split_translatable(text):
+    core = text.strip()
+    if not any(char.isalpha() for char in core):
+        return [(False, text)] if text else []
+    start = text.index(core)
+    segments = [(True, core)]
+    if start:
+        segments.insert(0, (False, text[:start]))
+    if start + len(core) < len(text):
+        segments.append((False, text[start + len(core):]))
+    return segments
+
+
+def split_sentences(segments):
+    """翻訳する部分を文ごとに分割（文の区切りの空白・改行は (None, 区切り) として残す）"""
+    result = []
+    for is_translatable, segment in segments:
+        if not is_translatable:
+            result.append((False, segment))
+            continue
+        pieces = SENTENCE_BOUNDARY_PATTERN.split(segment)
+        for index, piece in enumerate(pieces):
+            if index % 2:
+                result.append((None, piece))
+            else:
+                result.extend(_split_translatable(piece))
+    return result
+
+
+def translation_units(text, by_sentence=False):
+    """テキストを1回ずつ翻訳する単位に分割
+
+    (False, 文字列): そのまま残す部分（先頭・末尾の翻訳しない部分、文の区切り）
+    (True, [(翻訳しない部分か, 文字列), ...]): 1回で翻訳する部分。文中のメンション・URLなどは
+    分割せずにプレースホルダーとして一緒に送り、語順が変わっても訳文の正しい位置に戻す
+    """
+    segments = split_protected_spans(text)
+    if by_sentence:
+        segments = split_sentences(segments)
+
+    units = []
+    group = []
+
+    def close_group():
+        positions = [index for index, (is_translatable, _) in enumerate(group) if is_translatable]
+        if not positions:
+            if group:
+                units.append((False, "".join(segment for _, segment in group)))
+            return
+        first, last = positions[0], positions[-1]
+        if first:
+            units.append((False, "".join(segment for _, segment in group[:first])))
+        parts = []
+        for is_translatable, segment in group[first:last + 1]:
+            is_span = not is_translatable and PROTECTED_SPAN_PATTERN.fullmatch(segment) is not None
+            if parts and not is_span and not parts[-1][0]:
+                parts[-1] = (False, parts[-1][1] + segment)  # 空白・記号は前後のテキストとつなげる
+            else:
+                parts.append((is_span, segment))
+        units.append((True, parts))
+        if last + 1 < len(group):
+            units.append((False, "".join(segment for _, segment in group[last + 1:])))
+
+    for is_translatable, segment in segments:
+        if is_translatable is None:
+            close_group()
+            group = []
+            if segment:
+                units.append((False, segment))
         else:
-            detected_lang = source_lang
+            group.append((is_translatable, segment))
+    close_group()
+    return units
+
+
+PLACEHOLDER_PATTERN = re.compile(rf'<{DEEPL_PLACEHOLDER_TAG} id="(\d+)"\s*/>'
+                                 rf'|<{DEEPL_PLACEHOLDER_TAG} id="(\d+)">\s*</{DEEPL_PLACEHOLDER_TAG}>')
+XML_ENTITIES = {"&quot;": '"', "&apos;": "'"}
 
-        # 翻訳先言語を決定（中国語繁体字 ↔ 韓国語）
-        if detected_lang == "zh" or detected_lang == "zh-tw" or detected_lang == "zh-hant":
-            target_lang = "KO"  # 中国語 → 韓国語
-        elif detected_lang == "ko":
-            target_lang = "ZH-HANT"  # 韓国語 → 中国語繁体字
+
+def placeholder_markup(parts):
+    """文中の翻訳しない部分をプレースホルダータグに置き換えたXML（DeepLの tag_handling=xml 用）"""
+    markup = []
+    span_count = 0
+    for is_span, segment in parts:
+        if is_span:
+            markup.append(f'<{DEEPL_PLACEHOLDER_TAG} id="{span_count}"/>')
+            span_count += 1
         else:
-            # その他の言語は韓国語に翻訳
-            target_lang = "KO"
+            markup.append(xml_escape(segment))
+    return "".join(markup)
+
+
+def restore_placeholders(markup, parts):
+    """訳文のプレースホルダーを元の部分に戻す（タグが欠けた・重複した場合はNone）"""
+    spans = [segment for is_span, segment in parts if is_span]
+    restored = []
+    seen = set()
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(markup):
+        span_index = int(match.group(1) or match.group(2))
+        if span_index >= len(spans) or span_index in seen:
+            return None
+        seen.add(span_index)
+        restored.append(xml_unescape(markup[position:match.start()], XML_ENTITIES))
+        restored.append(spans[span_index])
+        position = match.end()
+    if len(seen) != len(spans):
+        return None
+    restored.append(xml_unescape(markup[position:], XML_ENTITIES))
+    return "".join(restored)
+
+
+def has_translatable_text(text):
+    """メンション・絵文字・URLなどを除いて翻訳する文字が残るか"""
+    return any(translatable for translatable, _ in split_protected_spans(text))
+
+
+async def protect_stage(request):
+    """翻訳しない部分を翻訳APIに送らずに翻訳し、元の位置に戻す
+
+    先頭・末尾の翻訳しない部分は除いて送り、文中のものはプレースホルダーにして文ごと送る。
+    """
+    if request.is_segment:
+        return
+    segments = split_protected_spans(request.text)
+    translatable = [segment for is_translatable, segment in segments if is_translatable]
+    protected_span_stats["characters_in"] += len(request.text)
+    protected_span_stats["characters_out"] += sum(len(segment) for segment in translatable)
+
+    if not translatable:
+        protected_span_stats["skipped"] += 1
+        request.result = {"success": False, "skipped": True, "error": "翻訳するテキストがありません"}
+        return
+    if len(segments) > 1:
+        protected_span_stats["segmented"] += 1
+
+    units = translation_units(request.text, by_sentence=request.by_sentence)
+    cores = [parts for is_core, parts in units if is_core]
+    if len(cores) > 1:
+        protected_span_stats["sentence_split"] += 1
+    if len(units) == 1:
+        # 前後に除く部分がない（文中の翻訳しない部分はバックエンドがプレースホルダーで扱う）
+        if len(cores[0]) > 1:
+            request.protected_parts = cores[0]
+        return
+
+    # 各部分を同じ翻訳元・翻訳先で翻訳（同時に送るので1回のDeepL呼び出しにまとまる）
+    # 各部分は個別にキャッシュされるため、メッセージが編集されても変わっていない文はAPIを呼ばない
+    results = await asyncio.gather(*(
+        translation_pipeline.run("".join(segment for _, segment in parts), request.target_lang,
+                                 request.detected_lang, is_segment=True,
+                                 protected_parts=parts if len(parts) > 1 else None)
+        for parts in cores
+    ))
+    failed = next((result for result in results if not result["success"]), None)
+    if failed is not None:
+        request.result = failed
+        return
+
+    translated = iter(result["translated_text"] for result in results)
+    request.segmented = True
+    request.result = translation_cache.remember(request.cache_key, {
+        "success": True,
+        "translated_text": "".join(next(translated) if is_core else text for is_core, text in units),
+        "source_lang": request.detected_lang,
+        "target_lang": request.target_lang,
+        "service": results[0]["service"]
+    })
+
+
+def protected_span_info():
+    stats = dict(protected_span_stats)
+    saved = stats["characters_in"] - stats["characters_out"]
+    stats["characters_saved"] = saved
+    stats["saved_ratio"] = round(saved / stats["characters_in"], 4) if stats["characters_in"] else 0.0
+    return stats
+
+
+async def normalize_stage(request):
+    request.normalized_text = normalize_text(request.text)
+    if not request.normalized_text:
+        request.result = {"success": False, "error": "翻訳するテキストがありません"}
 
-        # まずDeepL APIを試す
+
+async def detect_stage(request):
+    request.detected_lang = request.source_lang or detect_language(request.text)
+    if request.target_lang is None:
+        request.target_lang = auto_target_lang(request.detected_lang)
+    # テキストが十分長い場合のみsource_langを指定（短いテキストの場合は自動検出を使用）
+    request.deepl_source = request.detected_lang.upper() if len(request.text.strip()) > 3 else None
+
+
+async def cache_stage(request):
+    # キャッシュに同じ翻訳があればAPIを呼ばずに返す
+    request.cache_key = translation_cache.make_key(request.text, request.detected_lang, request.target_lang)
+    started_at = time.perf_counter()
+    cached_result = await translation_cache.lookup(request.cache_key)
+    cache_lookup_seconds.observe(time.perf_counter() - started_at, "miss" if cached_result is None else "hit")
+    if cached_result is not None:
+        request.cache_hit = True
+        request.result = cached_result
+
+
+async def rate_limit_stage(request):
+    # DeepLの障害中・文字数枠切れ・レート超過時は呼び出さずにフォールバック
+    tag_handling = "xml" if request.protected_parts else None
+    request.use_deepl = can_use_deepl(request.text, request.target_lang, request.deepl_source, tag_handling)
+
+
+# バックエンドを呼び出さなかったことを表す戻り値（レイテンシとして記録しない）
+SKIP_BACKEND = object()
+
+
+async def deepl_backend(request):
+    """DeepLで翻訳（失敗した場合はNone、使えない場合はSKIP_BACKENDを返して次のバックエンドへ）"""
+    if not request.use_deepl:
+        return SKIP_BACKEND
+    text, tag_handling = request.text, None
+    if request.protected_parts:
+        # 文中の翻訳しない部分はプレースホルダータグにして、語順が変わっても正しい位置に戻す
+        text, tag_handling = placeholder_markup(request.protected_parts), "xml"
+    try:
+        # 同時に来た翻訳とまとめて送信（イベントループをブロックしない）
+        status, translated_text = await deepl_batcher.translate(
+            text, request.target_lang, request.deepl_source, tag_handling)
+    except asyncio.TimeoutError:
+        print("🔄 DeepL API タイムアウト - Google Translateにフォールバック")
+        return None
+    except aiohttp.ClientError as e:
+        print(f"🔄 DeepL API ネットワークエラー - Google Translateにフォールバック: {str(e)}")
+        return None
+
+    if status != 200:
+        # DeepLでエラー発生時（無料枠切れなど）はフォールバックを使用
+        print(f"🔄 DeepL API エラー（{status}）- Google Translateにフォールバック")
+        return None
+    if request.protected_parts:
+        translated_text = restore_placeholders(translated_text, request.protected_parts)
+        if translated_text is None:
+            print("🔄 DeepLの訳文のプレースホルダーが一致しません - Google Translateにフォールバック")
+            return None
+    return {
+        "success": True,
+        "translated_text": translated_text,
+        "source_lang": request.detected_lang,
+        "target_lang": request.target_lang,
+        "service": "DeepL"
+    }
+
+
+async def google_backend(request):
+    if request.protected_parts:
+        return await translate_parts_with_google(request)
+    return await translate_with_google(request.text, request.detected_lang, request.target_lang)
+
+
+async def translate_parts_with_google(request):
+    """Google翻訳はプレースホルダーを扱えないため、文中の翻訳しない部分の前後を別々に翻訳する"""
+    pieces = []
+    for is_span, segment in request.protected_parts:
+        pieces.extend([(False, segment)] if is_span else _split_translatable(segment))
+    translatable = [segment for is_translatable, segment in pieces if is_translatable]
+    results = await asyncio.gather(*(
+        translate_with_google(segment, request.detected_lang, request.target_lang) for segment in translatable
+    ))
+    failed = next((result for result in results if not result["success"]), None)
+    if failed is not None:
+        return failed
+
+    translated = iter(result["translated_text"] for result in results)
+    return {
+        **results[0],
+        "translated_text": "".join(next(translated) if is_translatable else segment
+                                   for is_translatable, segment in pieces)
+    }
+
+
+def cache_result(request, result):
+    """バックエンドで得た成功結果をキャッシュに保存"""
+    if not request.cache_hit:
+        translation_cache.remember(request.cache_key, result)
+    return result
+
+
+class SingleFlight:
+    """同じキーの処理が実行中なら、新しく実行せずにその結果を待つ
+
+    処理は呼び出し元とは別のタスクで実行するため、最初の呼び出し元がキャンセルされても
+    同じ結果を待っている他の呼び出し元には影響しない。
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> 実行中のタスク
+        self.leaders = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """func() の結果と、他の呼び出しの結果を共有したかどうかを返す"""
+        task = self._calls.get(key)
+        if task is not None:
+            self.coalesced += 1
+            coalesced_total.inc()
+            return dict(await asyncio.shield(task)), True
+
+        self.leaders += 1
+        task = asyncio.ensure_future(func())
+        self._calls[key] = task
+        task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task), False
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced
+        }
+
+
+class TranslationPipeline:
+    """翻訳を段階に分けて実行する
+
+    stages: request を受け取るコルーチン関数のリスト。request.result を設定すると以降を省略
+    call_stages: バックエンドを呼ぶ直前に実行する段階（同じ翻訳が実行中なら省略される）
+    backends: request を受け取り結果（失敗時はNone、呼び出さなかった場合はSKIP_BACKEND）を返すコルーチン関数のリスト。前から順に試す
+    post_processors: (request, result) を受け取り結果を返す関数のリスト
+    single_flight: 指定すると同じキャッシュキーの同時リクエストでバックエンドを1回だけ呼ぶ
+    """
+
+    def __init__(self, stages, backends, call_stages=(), post_processors=(), single_flight=None):
+        self.stages = list(stages)
+        self.call_stages = list(call_stages)
+        self.backends = list(backends)
+        self.post_processors = list(post_processors)
+        self.single_flight = single_flight
+        self.requests = 0
+        self.cache_hits = 0
+        self.errors = 0
+        self.by_target = {}
+        self.by_service = {}
+
+    async def run(self, text, target_lang=None, source_lang=None, is_segment=False, protected_parts=None,
+                  by_sentence=False):
+        if not is_segment:
+            self.requests += 1  # メッセージの一部の翻訳は元のメッセージの1件として数える
+        request = TranslationRequest(text, target_lang, source_lang, is_segment, protected_parts, by_sentence)
         try:
-            # DeepL APIパラメータ（短いテキストの場合は自動検出を使用）
-            params = {
-                "auth_key": DEEPL_TOKEN,
-                "text": text,
-                "target_lang": target_lang
-            }
-            
-            # テキストが十分長い場合のみsource_langを指定
-            if len(text.strip()) > 3:
-                params["source_lang"] = detected_lang.upper()
-
-            # API呼び出し
-            response = requests.post(DEEPL_API_URL, data=params, timeout=10)
-
-            if response.status_code == 200:
-                response_json = response.json()
-                translated_text = response_json["translations"][0]["text"]
-                return {
-                    "success": True,
-                    "translated_text": translated_text,
-                    "source_lang": detected_lang,
-                    "target_lang": target_lang,
-                    "service": "DeepL"
-                }
-            else:
-                # DeepLでエラー発生時（無料枠切れなど）はフォールバックを使用
-                print(f"🔄 DeepL API エラー（{response.status_code}）- Google Translateにフォールバック")
-                return await translate_with_google(text, detected_lang, target_lang)
+            for stage in self.stages:
+                await stage(request)
+                if request.result is not None:
+                    break
+
+            result = request.result
+            if result is None and self.single_flight is not None:
+                result, request.coalesced = await self.single_flight.do(
+                    request.cache_key, lambda: self._call_backends(request))
+            elif result is None:
+                result = await self._call_backends(request)
+        except Exception as e:
+            # 予期しないエラーの場合もフォールバック
+            print(f"🔄 予期しないエラー - Google Translateにフォールバック: {str(e)}")
+            result = await translate_with_google(
+                text, request.detected_lang or "auto", request.target_lang or "KO")
+
+        self._record(request, result)
+        return result
+
+    async def _call_backends(self, request):
+        for stage in self.call_stages:
+            await stage(request)
+            if request.result is not None:
+                return request.result
+
+        for backend in self.backends:
+            started_at = time.perf_counter()
+            backend_result = await backend(request)
+            if backend_result is SKIP_BACKEND:
+                continue
+            result = backend_result
+            succeeded = result is not None and result["success"]
+            backend_seconds.observe(time.perf_counter() - started_at, backend.__name__.removesuffix("_backend"),
+                                    "success" if succeeded else "fallthrough")
+            if succeeded:
+                break
 
-        except requests.exceptions.Timeout:
-            print("🔄 DeepL API タイムアウト - Google Translateにフォールバック")
-            return await translate_with_google(text, detected_lang, target_lang)
-        except requests.exceptions.RequestException as e:
-            print(f"🔄 DeepL API ネットワークエラー - Google Translateにフォールバック: {str(e)}")
-            return await translate_with_google(text, detected_lang, target_lang)
+        if result["success"]:
+            for post_process in self.post_processors:
+                result = post_process(request, result)
+        return result
+
+    def _record(self, request, result):
+        if request.is_segment:
+            # 件数は元のメッセージで記録し、部分ごとには実際にバックエンドへ送った文字数だけを数える
+            if result["success"] and not (request.cache_hit or request.coalesced):
+                translated_characters_total.inc(result.get("target_lang", request.target_lang),
+                                                result.get("service", "unknown"), amount=len(request.text))
+            return
+        if request.cache_hit:
+            self.cache_hits += 1
+        if result.get("skipped"):
+            return
+        if not result["success"]:
+            self.errors += 1
+            return
+        target = result.get("target_lang", request.target_lang)
+        self.by_target[target] = self.by_target.get(target, 0) + 1
+        service = result.get("service", "unknown")
+        self.by_service[service] = self.by_service.get(service, 0) + 1
+        translations_total.inc(target, service)
+        if not (request.cache_hit or request.coalesced or request.segmented):
+            translated_characters_total.inc(target, service, amount=len(request.text))
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "cache_hits": self.cache_hits,
+            "errors": self.errors,
+            "by_target": dict(self.by_target),
+            "by_service": dict(self.by_service),
+            "single_flight": self.single_flight.stats() if self.single_flight is not None else None
+        }
+
+
+translation_pipeline = TranslationPipeline(
+    stages=[normalize_stage, detect_stage, cache_stage, protect_stage],
+    call_stages=[rate_limit_stage],
+    backends=[deepl_backend, google_backend],
+    post_processors=[cache_result],
+    single_flight=SingleFlight()
+)
+
+
+async def translate(text, target_lang=None, source_lang=None, by_sentence=False):
+    """テキストを翻訳する（target_lang 省略時は中国語繁体字 ↔ 韓国語の自動翻訳）
+
+    by_sentence=True では文ごとに翻訳・キャッシュする（自動翻訳するメッセージと編集されたメッセージ用）
+    """
+    return await translation_pipeline.run(text, target_lang, source_lang, by_sentence=by_sentence)
 
-    except Exception as e:
-        # 予期しないエラーの場合もフォールバック
-        print(f"🔄 予期しないエラー - Google Translateにフォールバック: {str(e)}")
-        return await translate_with_google(text, "auto", "JA")
+
+# 翻訳関数（DeepL + フォールバック対応）
+async def translate_text(text, source_lang=None, by_sentence=False):
+    """DeepLとGoogle Translateフォールバック対応翻訳関数"""
+    return await translate(text, source_lang=source_lang, by_sentence=by_sentence)
 
 # 日本語翻訳専用関数（ボタン用）
 async def translate_to_japanese(text, source_lang=None):
     """元のテキストを日本語に翻訳する関数"""
-    try:
-        # 言語を自動判定
-        if not source_lang:
-            detected_lang = detect_language(text)
-        else:
-            detected_lang = source_lang
+    return await translate(text, "JA", source_lang)
+
+# 英語翻訳専用関数（ボタン用）
+async def translate_to_english(text, source_lang=None):
+    """元のテキストを英語に翻訳する関数"""
+    return await translate(text, "EN", source_lang)
+
+# ヘッジリクエスト設定（ボタン翻訳でDeepLが遅い時はGoogle翻訳も並行して実行）
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', '').lower() in ('1', 'true', 'yes')
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '90'))  # DeepLの応答時間のこのパーセンタイルを待ち時間にする
+HEDGE_MIN_BUDGET_MS = float(os.getenv('HEDGE_MIN_BUDGET_MS', '300'))  # 待ち時間の下限
+HEDGE_DEFAULT_BUDGET_MS = float(os.getenv('HEDGE_DEFAULT_BUDGET_MS', '1500'))  # 応答時間の記録が少ない間の待ち時間
+HEDGE_MIN_SAMPLES = 20
+
+# ヘッジの実行状況（対象件数 / Google翻訳を並行実行した件数 / 採用されたサービス）
+hedge_stats = {"eligible": 0, "fired": 0, "wins": {}}
+
+
+# Embedの色で翻訳サービスを表す（DeepL=緑, Google=青）
+DEEPL_COLOR = 0x00ff00
+GOOGLE_COLOR = 0x4285f4
+
+
+def service_color(service, default=GOOGLE_COLOR):
+    """翻訳サービス名からEmbedの色を決める（不明な場合は default）"""
+    if service == "DeepL":
+        return DEEPL_COLOR
+    if service == "Google Translate":
+        return GOOGLE_COLOR
+    return default
 
-        # DeepL APIで日本語に翻訳
-        try:
-            params = {
-                "auth_key": DEEPL_TOKEN,
-                "text": text,
-                "target_lang": "JA"  # 日本語
-            }
 
-            if len(text.strip()) > 3:
-                params["source_lang"] = detected_lang.upper()
-
-            response = requests.post(DEEPL_API_URL, data=params, timeout=10)
-
-            if response.status_code == 200:
-                response_json = response.json()
-                translated_text = response_json["translations"][0]["text"]
-                return {
-                    "success": True,
-                    "translated_text": translated_text,
-                    "source_lang": detected_lang,
-                    "target_lang": "JA",
-                    "service": "DeepL"
-                }
+def hedge_budget():
+    """Google翻訳を並行実行するまでの待ち時間（秒）"""
+    if len(deepl_latency) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_BUDGET_MS / 1000
+    return max(deepl_latency.percentile(HEDGE_PERCENTILE), HEDGE_MIN_BUDGET_MS / 1000)
+
+
+async def translate_with_hedge(text, source_lang, target_lang, translate_func):
+    """translate_func がDeepLの待ち時間内に終わらなければGoogle翻訳も開始し、先に成功した結果を使う
+
+    負けた方の処理はキャンセルする。結果の "service" に採用されたサービスが入る。
+    """
+    hedge_stats["eligible"] += 1
+    primary = asyncio.create_task(translate_func(text, source_lang))
+    done, _ = await asyncio.wait({primary}, timeout=hedge_budget())
+    if done:
+        return primary.result()
+
+    hedge_stats["fired"] += 1
+    secondary = asyncio.create_task(translate_with_google(text, source_lang, target_lang))
+    pending = {primary, secondary}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result["success"]:
+                    service = result.get("service", "unknown")
+                    hedge_stats["wins"][service] = hedge_stats["wins"].get(service, 0) + 1
+                    if task is secondary:
+                        translation_cache.remember(
+                            translation_cache.make_key(text, source_lang, target_lang), result)
+                    return result
+    finally:
+        for task in pending:
+            task.cancel()
+    # 両方失敗した場合はDeepL側（フォールバック込み）の結果を返す
+    return primary.result()
+
+
+def hedge_info():
+    budget = hedge_budget()
+    return {
+        "enabled": HEDGE_ENABLED,
+        "budget_ms": round(budget * 1000, 1),
+        "deepl_p50_ms": round(deepl_latency.percentile(50) * 1000, 1) if len(deepl_latency) else None,
+        "deepl_p90_ms": round(deepl_latency.percentile(90) * 1000, 1) if len(deepl_latency) else None,
+        "eligible": hedge_stats["eligible"],
+        "fired": hedge_stats["fired"],
+        "hedge_rate": round(hedge_stats["fired"] / hedge_stats["eligible"], 4) if hedge_stats["eligible"] else 0.0,
+        "wins": dict(hedge_stats["wins"])
+    }
+
+# 翻訳スケジューラ設定（スパムが他チャンネルやボタン操作を圧迫しないように）
+TRANSLATION_MAX_IN_FLIGHT = int(os.getenv('TRANSLATION_MAX_IN_FLIGHT', '16'))  # 全体の同時翻訳数
+PRIORITY_INTERACTIVE = 0  # ボタンクリック（ユーザーが待っている）
+PRIORITY_AUTO = 1  # メッセージの自動翻訳
+
+
+class TranslationScheduler:
+    """翻訳処理の同時実行数を制限し、チャンネルごとに公平に順番を回すスケジューラ
+
+    - 全体の同時実行数を max_in_flight に制限
+    - 優先度ごとにチャンネル別の待ち行列を持ち、チャンネルを順番に回して1件ずつ実行
+    - ボタンクリック（PRIORITY_INTERACTIVE）を自動翻訳（PRIORITY_AUTO）より優先
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self._queues = {PRIORITY_INTERACTIVE: OrderedDict(), PRIORITY_AUTO: OrderedDict()}  # channel_id -> deque
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.completed = 0
+        self.queued = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _pop_next(self):
+        for priority in sorted(self._queues):
+            queues = self._queues[priority]
+            if queues:
+                channel_id, queue = next(iter(queues.items()))
+                future = queue.popleft()
+                # チャンネルを末尾に回す（空になったら削除）
+                if queue:
+                    queues.move_to_end(channel_id)
+                else:
+                    del queues[channel_id]
+                self.queue_depth -= 1
+                return future
+        return None
+
+    def _wake_next(self):
+        while self.in_flight < self.max_in_flight:
+            future = self._pop_next()
+            if future is None:
+                return
+            self.in_flight += 1
+            future.set_result(None)
+
+    def _remove_waiter(self, channel_id, priority, future):
+        queue = self._queues[priority].get(channel_id)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self.queue_depth -= 1
+            if not queue:
+                del self._queues[priority][channel_id]
+
+    async def _acquire(self, channel_id, priority):
+        if self.in_flight < self.max_in_flight and self.queue_depth == 0:
+            self.in_flight += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(channel_id, deque()).append(future)
+        self.queue_depth += 1
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        started_at = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 枠を割り当てられた直後にキャンセルされた場合は次に回す
+                self._release()
             else:
-                # DeepLでエラー発生時はGoogle Translateにフォールバック
-                print(f"🔄 DeepL API エラー（{response.status_code}）- Google Translateにフォールバック")
-                result = google_translator.translate(text, dest="ja", src=detected_lang)
-                return {
-                    "success": True,
-                    "translated_text": result.text,
-                    "source_lang": detected_lang,
-                    "target_lang": "JA",
-                    "service": "Google Translate"
-                }
-
-        except requests.exceptions.Timeout:
-            print("🔄 DeepL API タイムアウト - Google Translateにフォールバック")
-            result = google_translator.translate(text, dest="ja", src=detected_lang)
-            return {
-                "success": True,
-                "translated_text": result.text,
-                "source_lang": detected_lang,
-                "target_lang": "JA",
-                "service": "Google Translate"
-            }
-        except requests.exceptions.RequestException as e:
-            print(f"🔄 DeepL API ネットワークエラー - Google Translateにフォールバック: {str(e)}")
-            result = google_translator.translate(text, dest="ja", src=detected_lang)
-            return {
-                "success": True,
-                "translated_text": result.text,
-                "source_lang": detected_lang,
-                "target_lang": "JA",
-                "service": "Google Translate"
-            }
+                self._remove_waiter(channel_id, priority, future)
+            raise
+
+        waited = time.monotonic() - started_at
+        scheduler_wait_seconds.observe(waited)
+        self.waited += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake_next()
+
+    @asynccontextmanager
+    async def slot(self, channel_id, priority=PRIORITY_AUTO):
+        """翻訳1件分の実行枠（順番が来るまで待つ）"""
+        await self._acquire(channel_id, priority)
+        try:
+            yield
+        finally:
+            self.completed += 1
+            self._release()
 
-    except Exception as e:
-        print(f"❌ 日本語翻訳エラー: {str(e)}")
+    def stats(self):
         return {
-            "success": False,
-            "error": f"翻訳エラー: {str(e)}"
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queue_depth_interactive": sum(len(q) for q in self._queues[PRIORITY_INTERACTIVE].values()),
+            "queue_depth_auto": sum(len(q) for q in self._queues[PRIORITY_AUTO].values()),
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "queued": self.queued,
+            "average_wait_ms": round(self.total_wait / self.waited * 1000, 1) if self.waited else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1)
         }
 
-# 英語翻訳専用関数（ボタン用）
-async def translate_to_english(text, source_lang=None):
-    """元のテキストを英語に翻訳する関数"""
+
+translation_scheduler = TranslationScheduler(TRANSLATION_MAX_IN_FLIGHT)
+metrics.gauge("translator_queue_depth", "Translations waiting for a scheduler slot",
+              lambda: translation_scheduler.queue_depth)
+metrics.gauge("translator_in_flight", "Translations currently running",
+              lambda: translation_scheduler.in_flight)
+
+# バックグラウンドでのウォームアップ（言語判別プロファイル・翻訳クライアントの準備）
+warmup_task = None
+
+
+async def warm_up_translators():
+    """langdetectのプロファイル読み込みとGoogle翻訳器の作成をスレッドで実行"""
+    from langdetect.detector_factory import init_factory
+
+    loop = asyncio.get_running_loop()
     try:
-        # 言語を自動判定
-        if not source_lang:
-            detected_lang = detect_language(text)
-        else:
-            detected_lang = source_lang
+        await asyncio.gather(
+            loop.run_in_executor(None, init_factory),
+            google_translator.warm_up()
+        )
+    except Exception as e:
+        print(f"⚠️ ウォームアップエラー（初回使用時に再試行されます）: {e}")
+    record_startup_phase("warmup_complete")
 
-        # DeepL APIで英語に翻訳
-        try:
-            params = {
-                "auth_key": DEEPL_TOKEN,
-                "text": text,
-                "target_lang": "EN"  # 英語
-            }
 
-            if len(text.strip()) > 3:
-                params["source_lang"] = detected_lang.upper()
-
-            response = requests.post(DEEPL_API_URL, data=params, timeout=10)
-
-            if response.status_code == 200:
-                response_json = response.json()
-                translated_text = response_json["translations"][0]["text"]
-                return {
-                    "success": True,
-                    "translated_text": translated_text,
-                    "source_lang": detected_lang,
-                    "target_lang": "EN",
-                    "service": "DeepL"
-                }
+def start_warm_up():
+    """ウォームアップを開始（Gateway接続後に1回だけ）"""
+    global warmup_task
+    if warmup_task is None:
+        warmup_task = asyncio.create_task(warm_up_translators())
+
+
+async def wait_until_warmed_up():
+    """ウォームアップ完了まで待つ（完了済み・未開始なら即座に戻る）"""
+    if warmup_task is not None and not warmup_task.done():
+        await asyncio.shield(warmup_task)
+
+# 翻訳ボタン（メッセージごとのViewを保持せず、custom_id の翻訳先から1つの処理で応答する）
+# 翻訳先 -> (ボタンのラベル, 追加する行の国旗, 翻訳関数, エラー表示用の言語名)
+BUTTON_TARGETS = {
+    "JA": ("日本語", "🇯🇵", translate_to_japanese, "日本語"),
+    "EN": ("English", "🇺🇸", translate_to_english, "英語"),
+}
+LEGACY_BUTTON_TARGETS = {"japanese": "JA", "english": "EN"}  # 変更前のメッセージのボタン
+
+
+class TranslateButton(discord.ui.DynamicItem[Button],
+                      template=r"tr:(?P<target>JA|EN)(?::(?P<index>\d):(?P<source>\d+))?"
+                               r"|translate_to_(?P<legacy>japanese|english)"):
+    """custom_id が tr:JA / tr:EN のボタン（変更前の translate_to_japanese なども受け付ける）
+
+    元のテキストはメッセージIDからメッセージ保存を引くため、ボタン自体は状態を持たない。
+    複数の翻訳をまとめて送ったメッセージでは tr:JA:<Embed番号>:<元メッセージID> とし、
+    元メッセージIDでメッセージ保存を引く。
+    """
+
+    def __init__(self, target_lang, disabled=False, index=None, source_id=None):
+        label = BUTTON_TARGETS[target_lang][0]
+        custom_id = f"tr:{target_lang}"
+        if source_id is not None:
+            label = f"#{index + 1} {label}"
+            custom_id += f":{index}:{source_id}"
+        super().__init__(Button(label=label, style=discord.ButtonStyle.primary,
+                                custom_id=custom_id, disabled=disabled),
+                         row=None if index is None else index // 2)
+        self.target_lang = target_lang
+        self.index = index
+        self.source_id = source_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        if match["source"] is not None:
+            return cls(match["target"], index=int(match["index"]), source_id=int(match["source"]))
+        return cls(match["target"] or LEGACY_BUTTON_TARGETS[match["legacy"]])
+
+    async def callback(self, interaction):
+        """翻訳ボタンがクリックされた時の処理"""
+        await interaction.response.defer()
+        await wait_until_warmed_up()
+
+        _, flag, _, language_name = BUTTON_TARGETS[self.target_lang]
+        result = await translate_original(interaction, self.target_lang, self.source_id)
+
+        if result["success"]:
+            # 既存のEmbedに翻訳を追加し、翻訳済みのボタンを無効化（同時に押されたボタンの結果は1回の編集にまとめる）
+            line = f"{flag}： " + result["translated_text"]
+            shown = await message_editor.add_line(
+                interaction.message, self.index or 0, self.target_lang, line,
+                service_color(result.get("service"), None)  # ヘッジ時は採用されたサービスの色
+            )
+            if not shown:
+                # メッセージの文字数の上限に達していて追加できない場合は、押した人にだけ表示する
+                await interaction.followup.send(line, ephemeral=True)
+        else:
+            await interaction.followup.send(f"❌ {language_name}翻訳に失敗しました", ephemeral=True)
+
+
+def translation_buttons(disabled=()):
+    """翻訳メッセージに付けるボタン（disabled の翻訳先は無効化）"""
+    view = View(timeout=None)
+    for target_lang in BUTTON_TARGETS:
+        view.add_item(TranslateButton(target_lang, disabled=target_lang in disabled))
+    return view
+
+
+def packed_translation_buttons(source_ids, disabled=None):
+    """複数の翻訳をまとめたメッセージのボタン（Embedごとに1組、disabled はEmbedごとの無効化する翻訳先）"""
+    view = View(timeout=None)
+    for index, source_id in enumerate(source_ids):
+        for target_lang in BUTTON_TARGETS:
+            view.add_item(TranslateButton(target_lang, disabled=bool(disabled) and target_lang in disabled[index],
+                                          index=index, source_id=source_id))
+    return view
+
+
+# ボタン翻訳のメッセージ編集（同じメッセージへの編集を順番に行い、短時間に届いた翻訳は1回の編集にまとめる）
+BUTTON_EDIT_WINDOW_MS = float(os.getenv('BUTTON_EDIT_WINDOW_MS', '200'))
+BUTTON_EDIT_MAX_MESSAGES = 1000  # 編集後の内容を覚えておくメッセージ数
+EMBED_TOTAL_MAX_CHARACTERS = 6000  # Discordの1メッセージあたりのEmbedの合計文字数の上限
+EMBED_DESCRIPTION_MAX_CHARACTERS = 4096  # Discordの1つのEmbedの本文の文字数の上限
+
+
+class MessageEditAggregator:
+    """メッセージごとに翻訳行の追加をまとめて編集する
+
+    - 同じメッセージの編集は1つずつ行い、編集中に届いた行は次の編集にまとめる
+    - 直前の編集内容を覚えておき、古いメッセージ内容から作り直して他の翻訳を上書きしない
+    - 同じ翻訳先の行は1回だけ追加する（複数人が同時に同じボタンを押した場合）
+    - 複数の翻訳をまとめたメッセージでは、押されたボタンのEmbedにだけ行を追加する
+    - 元メッセージが編集されたときのEmbedの置き換えも同じ順番で行う
+    - Embedの合計文字数が max_characters を超える行は追加しない（Discordが編集を拒否するため）
+    """
+
+    def __init__(self, window, max_messages=BUTTON_EDIT_MAX_MESSAGES, max_characters=EMBED_TOTAL_MAX_CHARACTERS):
+        self.window = window
+        self.max_messages = max_messages
+        self.max_characters = max_characters
+        self._states = OrderedDict()  # message_id -> {"embeds", "applied", "sources"}
+        self._pending = {}  # message_id -> [(Embed番号, 翻訳先（置き換えはNone）, 行, 色, future)]
+        self._locks = {}  # message_id -> asyncio.Lock
+        self.lines = 0
+        self.merged = 0
+        self.duplicates = 0
+        self.replacements = 0
+        self.edits = 0
+        self.too_long = 0
+
+    async def add_line(self, message, index, target_lang, line, color=None):
+        """index 番目のEmbedに翻訳行を追加し、その行を含む編集が終わるまで待つ（文字数の上限で追加できなければFalse）"""
+        self.lines += 1
+        return await self._enqueue(message, index, target_lang, line, color)
+
+    async def replace(self, message, index, description, color):
+        """index 番目のEmbedの内容を置き換え、ボタンで追加した翻訳行とボタンの無効化を元に戻す（置き換えられなければFalse）"""
+        self.replacements += 1
+        return await self._enqueue(message, index, None, description, color)
+
+    async def _enqueue(self, message, index, target_lang, line, color):
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.get(message.id)
+        if pending is None:
+            pending = self._pending[message.id] = []
+            asyncio.create_task(self._flush_later(message))
+        else:
+            self.merged += 1
+        pending.append((index, target_lang, line, color, future))
+        return await future
+
+    async def _flush_later(self, message):
+        await asyncio.sleep(self.window)
+        lock = self._locks.setdefault(message.id, asyncio.Lock())
+        async with lock:
+            batch = self._pending.pop(message.id, [])
+            try:
+                await self._apply(message, batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
             else:
-                # DeepLでエラー発生時はGoogle Translateにフォールバック
-                print(f"🔄 DeepL API エラー（{response.status_code}）- Google Translateにフォールバック")
-                result = google_translator.translate(text, dest="en", src=detected_lang)
-                return {
-                    "success": True,
-                    "translated_text": result.text,
-                    "source_lang": detected_lang,
-                    "target_lang": "EN",
-                    "service": "Google Translate"
-                }
-
-        except requests.exceptions.Timeout:
-            print("🔄 DeepL API タイムアウト - Google Translateにフォールバック")
-            result = google_translator.translate(text, dest="en", src=detected_lang)
-            return {
-                "success": True,
-                "translated_text": result.text,
-                "source_lang": detected_lang,
-                "target_lang": "EN",
-                "service": "Google Translate"
-            }
-        except requests.exceptions.RequestException as e:
-            print(f"🔄 DeepL API ネットワークエラー - Google Translateにフォールバック: {str(e)}")
-            result = google_translator.translate(text, dest="en", src=detected_lang)
-            return {
-                "success": True,
-                "translated_text": result.text,
-                "source_lang": detected_lang,
-                "target_lang": "EN",
-                "service": "Google Translate"
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_result(True)
+            finally:
+                if message.id not in self._pending:
+                    self._locks.pop(message.id, None)
+
+    def _state_for(self, message):
+        state = self._states.get(message.id)
+        if state is None:
+            applied, sources = translation_button_layout(message)
+            state = {"embeds": [embed.copy() for embed in message.embeds], "applied": applied, "sources": sources}
+        self._states[message.id] = state
+        self._states.move_to_end(message.id)
+        while len(self._states) > self.max_messages:
+            self._states.popitem(last=False)
+        return state
+
+    async def _apply(self, message, batch):
+        state = self._state_for(message)
+        embeds = [embed.copy() for embed in state["embeds"]]
+        applied = [set(targets) for targets in state["applied"]]
+        total = sum(len(embed) for embed in embeds)
+        new_lines = 0
+        for index, target_lang, line, line_color, future in batch:
+            if index >= len(embeds):
+                continue
+            if target_lang is not None and target_lang in applied[index]:
+                self.duplicates += 1
+                continue
+            description = line if target_lang is None else embeds[index].description + "\n" + line
+            added = len(description) - len(embeds[index].description or "")
+            if total + added > self.max_characters or len(description) > EMBED_DESCRIPTION_MAX_CHARACTERS:
+                # Discordが編集を拒否するため、この行だけ追加せずに呼び出し元へ知らせる
+                self.too_long += 1
+                future.set_result(False)
+                continue
+            total += added
+            if target_lang is None:
+                # 元メッセージの編集: 翻訳をやり直したので日本語・英語ボタンも押せる状態に戻す
+                applied[index] = set()
+            else:
+                applied[index].add(target_lang)
+            embeds[index].description = description
+            if line_color is not None:
+                embeds[index].color = line_color
+            new_lines += 1
+        if not new_lines:
+            return
+
+        if state["sources"][0] is None:
+            view = translation_buttons(applied[0])
+        else:
+            view = packed_translation_buttons(state["sources"], applied)
+        with interaction_edit_seconds.time(str(new_lines)):
+            if len(embeds) == 1:
+                await message.edit(embed=embeds[0], view=view)
+            else:
+                await message.edit(embeds=embeds, view=view)
+        state["embeds"] = embeds
+        state["applied"] = applied
+        self.edits += 1
+
+    def stats(self):
+        return {
+            "window_ms": round(self.window * 1000, 1),
+            "lines": self.lines,
+            "merged": self.merged,
+            "duplicates": self.duplicates,
+            "replacements": self.replacements,
+            "edits": self.edits,
+            "too_long": self.too_long,
+            "pending_messages": len(self._pending)
+        }
+
+
+def translation_button_layout(message):
+    """メッセージのボタンから、Embedごとの無効化済みの翻訳先（翻訳行を追加済み）と元メッセージIDを返す"""
+    applied = [set() for _ in message.embeds]
+    sources = [None] * len(message.embeds)
+    for row in getattr(message, "components", ()):
+        for component in getattr(row, "children", ()):
+            match = TranslateButton.__discord_ui_compiled_template__.fullmatch(
+                getattr(component, "custom_id", None) or "")
+            if match is None:
+                continue
+            index = int(match["index"] or 0)
+            if index >= len(applied):
+                continue
+            if match["source"] is not None:
+                sources[index] = int(match["source"])
+            if component.disabled:
+                applied[index].add(match["target"] or LEGACY_BUTTON_TARGETS[match["legacy"]])
+    return applied, sources
+
+
+message_editor = MessageEditAggregator(BUTTON_EDIT_WINDOW_MS / 1000)
+
+
+async def translate_original(interaction, target_lang, source_id=None):
+    """元のテキストをボタンの言語に翻訳（元テキスト・過去の結果はメッセージ保存から取得）
+
+    まとめて送ったメッセージのボタンでは source_id（元メッセージID）で保存を引く。
+    """
+    message_id = source_id or interaction.message.id
+    entry = await message_store.get(message_id)
+    if entry is None:
+        # 保存件数の上限を超えた古いメッセージや、保存先ファイルなしで再起動した場合
+        return {"success": False, "error": "元のメッセージが見つかりません"}
+
+    # 同じメッセージで翻訳済みならAPIを呼ばない
+    translated_text = entry["translations"].get(target_lang)
+    if translated_text is not None:
+        return {
+            "success": True,
+            "translated_text": translated_text,
+            "source_lang": entry["source_lang"],
+            "target_lang": target_lang
+        }
+
+    # ボタンクリックは自動翻訳より優先して実行枠を割り当てる
+    translate_func = BUTTON_TARGETS[target_lang][2]
+    async with translation_scheduler.slot(interaction.channel_id, PRIORITY_INTERACTIVE):
+        if HEDGE_ENABLED:
+            result = await translate_with_hedge(
+                entry["original_text"], entry["source_lang"], target_lang, translate_func)
+        else:
+            result = await translate_func(entry["original_text"], entry["source_lang"])
+    if result["success"]:
+        current = await message_store.get(message_id)
+        if current is not None and current["original_text"] != entry["original_text"]:
+            # 翻訳中に元メッセージが編集された（新しい内容の翻訳は編集時に表示済み）
+            return {"success": False, "error": "元のメッセージが編集されました"}
+        message_store.add_translation(message_id, target_lang, result["translated_text"])
+    return result
+
+# 翻訳メッセージの送信（混雑しているチャンネルでは複数の翻訳を1つのメッセージにまとめる）
+OUTBOUND_PACKING = os.getenv('OUTBOUND_PACKING', 'true').lower() in ('1', 'true', 'yes')
+OUTBOUND_MAX_DELAY_MS = float(os.getenv('OUTBOUND_MAX_DELAY_MS', '1000'))  # 混雑時にまとめるため待つ最大時間
+OUTBOUND_BURST_SENDS = int(os.getenv('OUTBOUND_BURST_SENDS', '3'))  # 直近5秒にこの回数送信したチャンネルを混雑とみなす
+OUTBOUND_BURST_WINDOW = 5.0  # Discordのチャンネルごとの送信レート制限（5秒に5件）の単位
+OUTBOUND_MAX_EMBEDS = 10  # Discordの1メッセージあたりのEmbed数の上限
+
+outbound_wait_seconds = metrics.histogram(
+    "translator_outbound_wait_seconds", "Time a translation waited in the per-channel send queue")
+outbound_embeds_per_message = metrics.histogram(
+    "translator_outbound_embeds_per_message", "Translations packed into one Discord message",
+    buckets=(1, 2, 3, 5, 10))
+
+
+class OutboundPacker:
+    """チャンネルごとの翻訳メッセージ送信キュー
+
+    - 同じチャンネルへの送信は1つずつ行い、送信中に溜まった翻訳は次のメッセージにまとめる
+    - 直近の送信回数が多いチャンネルでは、最初の翻訳が max_delay 待つまで（または上限件数まで）集めてから送る
+    - 空いているチャンネルでは待たずにすぐ送る
+    - 1通のEmbedの合計文字数は、後からボタンで追加される翻訳行の分も見込んで max_characters までにする
+    - まとめて送れなかった場合は1件ずつ送り直す
+
+    まとめたメッセージのボタンは元メッセージIDを持つため、メッセージ保存のキーは元メッセージIDになる。
+    送信後は元メッセージの編集に備えて、翻訳を表示しているメッセージとEmbed番号を reply_index に記録する。
+    """
+
+    def __init__(self, max_delay, burst_sends, burst_window=OUTBOUND_BURST_WINDOW,
+                 max_embeds=OUTBOUND_MAX_EMBEDS, max_characters=EMBED_TOTAL_MAX_CHARACTERS, enabled=True):
+        self.max_delay = max_delay
+        self.burst_sends = burst_sends
+        self.burst_window = burst_window
+        self.max_embeds = max_embeds
+        self.max_characters = max_characters
+        self.enabled = enabled
+        self._channels = {}  # channel_id -> {"queue", "recent", "full", "task"}
+        self.translations = 0
+        self.messages = 0
+        self.packed_messages = 0
+        self.max_packed = 0
+        self.split_retries = 0
+
+    async def send(self, channel, embed, source_id):
+        """翻訳Embedを送信し、(送信したメッセージ, Embed番号, メッセージ保存のキー) を返す"""
+        self.translations += 1
+        if not self.enabled:
+            return await self._send_one(channel, embed)
+
+        state = self._channels.get(channel.id)
+        if state is None:
+            state = self._channels[channel.id] = {
+                "queue": [], "recent": deque(), "full": asyncio.Event(), "task": None
             }
+        future = asyncio.get_running_loop().create_future()
+        state["queue"].append((embed, source_id, time.monotonic(), future))
+        if self._full(state["queue"]):
+            state["full"].set()
+        if state["task"] is None:
+            state["task"] = asyncio.create_task(self._drain(channel, state))
+        return await future
+
+    async def _send_one(self, channel, embed):
+        with discord_send_seconds.time():
+            sent_message = await channel.send(embed=embed, view=translation_buttons())
+        self.messages += 1
+        outbound_embeds_per_message.observe(1)
+        return sent_message, 0, sent_message.id
+
+    @staticmethod
+    def _reserved_characters(embed, index):
+        """まとめたメッセージで embed が使う文字数（番号のフッターと、ボタンで追加される翻訳行の見込みを含む）"""
+        return len(embed) + len(f"#{index + 1}") + len(embed.description or "") * len(BUTTON_TARGETS)
+
+    def _batch_size(self, queue):
+        """キューの先頭から1通にまとめられる件数（最低1件）"""
+        total = 0
+        for index, (embed, *_) in enumerate(queue[:self.max_embeds]):
+            total += self._reserved_characters(embed, index)
+            if total > self.max_characters and index > 0:
+                return index
+        return min(len(queue), self.max_embeds)
+
+    def _full(self, queue):
+        """次の1通に入りきらないほど溜まっているか"""
+        return len(queue) >= self.max_embeds or self._batch_size(queue) < len(queue)
+
+    def _busy(self, state):
+        recent = state["recent"]
+        now = time.monotonic()
+        while recent and now - recent[0] > self.burst_window:
+            recent.popleft()
+        return len(recent) >= self.burst_sends
+
+    async def _drain(self, channel, state):
+        queue = state["queue"]
+        try:
+            while queue:
+                if self._busy(state) and not self._full(queue):
+                    remaining = queue[0][2] + self.max_delay - time.monotonic()
+                    if remaining > 0:
+                        try:
+                            await asyncio.wait_for(state["full"].wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                size = self._batch_size(queue)
+                batch = queue[:size]
+                del queue[:size]
+                if not self._full(queue):
+                    state["full"].clear()
+                await self._send_batch(channel, state, batch)
+        finally:
+            state["task"] = None
+
+    async def _send_batch(self, channel, state, batch):
+        now = time.monotonic()
+        for _, _, queued_at, _ in batch:
+            outbound_wait_seconds.observe(now - queued_at)
+        state["recent"].append(now)
+        try:
+            if len(batch) == 1:
+                results = [await self._send_one(channel, batch[0][0])]
+            else:
+                embeds = []
+                for index, (embed, _, _, _) in enumerate(batch):
+                    embed.set_footer(text=f"#{index + 1}")  # ボタンの番号と対応
+                    embeds.append(embed)
+                source_ids = [source_id for _, source_id, _, _ in batch]
+                with discord_send_seconds.time():
+                    sent_message = await channel.send(embeds=embeds, view=packed_translation_buttons(source_ids))
+                self.messages += 1
+                self.packed_messages += 1
+                self.max_packed = max(self.max_packed, len(batch))
+                outbound_embeds_per_message.observe(len(batch))
+                results = [(sent_message, index, source_id) for index, source_id in enumerate(source_ids)]
+        except Exception as e:
+            if len(batch) == 1:
+                self._fail(batch, e)
+                return
+            # まとめたメッセージが送れなかった場合は、全件を失敗にせず1件ずつ送り直す
+            print(f"⚠️ まとめた翻訳メッセージ（{len(batch)}件）の送信に失敗したため1件ずつ送ります: {e}")
+            self.split_retries += 1
+            for entry in batch:
+                embed, *_, future = entry
+                embed.remove_footer()
+                try:
+                    result = await self._send_one(channel, embed)
+                except Exception as retry_error:
+                    self._fail([entry], retry_error)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        else:
+            for (*_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
 
-    except Exception as e:
-        print(f"❌ 英語翻訳エラー: {str(e)}")
+    @staticmethod
+    def _fail(batch, error):
+        for *_, future in batch:
+            if not future.done():
+                future.set_exception(error)
+
+    def stats(self):
         return {
-            "success": False,
-            "error": f"翻訳エラー: {str(e)}"
+            "enabled": self.enabled,
+            "max_delay_ms": round(self.max_delay * 1000, 1),
+            "burst_sends": self.burst_sends,
+            "translations": self.translations,
+            "messages": self.messages,
+            "packed_messages": self.packed_messages,
+            "max_packed": self.max_packed,
+            "split_retries": self.split_retries,
+            "queued": sum(len(state["queue"]) for state in self._channels.values())
         }
 
-# Viewクラス（ボタンを含む）
-class TranslationView(View):
-    def __init__(self, original_text, source_lang):
-        super().__init__(timeout=None)  # タイムアウトなし（永続化）
-        self.original_text = original_text
-        self.source_lang = source_lang
 
-    @discord.ui.button(label="日本語", style=discord.ButtonStyle.primary, custom_id="translate_to_japanese")
-    async def japanese_button(self, interaction: discord.Interaction, button: Button):
-        """日本語翻訳ボタンがクリックされた時の処理"""
-        # ボタンを無効化
-        button.disabled = True
-        await interaction.response.defer()
+outbound_packer = OutboundPacker(
+    OUTBOUND_MAX_DELAY_MS / 1000,
+    OUTBOUND_BURST_SENDS,
+    enabled=OUTBOUND_PACKING
+)
 
-        # 元のテキストを日本語に翻訳
-        japanese_result = await translate_to_japanese(self.original_text, self.source_lang)
+# 元メッセージの編集への対応（翻訳をやり直し、Botの翻訳メッセージをその場で書き換える）
+# discord.py は直近のメッセージ（max_messages、デフォルト1000件）の編集しか on_message_edit を呼ばないため同じ件数だけ覚える
+REPLY_INDEX_MAX_ENTRIES = int(os.getenv('REPLY_INDEX_MAX_ENTRIES', '1000'))
 
-        if japanese_result["success"]:
-            # 既存のEmbedを取得して日本語訳を追加
-            original_embed = interaction.message.embeds[0]
-            current_description = original_embed.description
 
-            # 日本語訳を追加
-            new_description = current_description + "\n🇯🇵： " + japanese_result["translated_text"]
+class ReplyIndex:
+    """元メッセージID → (翻訳メッセージ, Embed番号, メッセージ保存のキー) の件数上限付きLRU"""
 
-            # Embedを更新
-            updated_embed = discord.Embed(
-                description=new_description,
-                color=original_embed.color
-            )
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
 
-            # メッセージを編集（ボタン無効化とEmbed更新）
-            await interaction.message.edit(embed=updated_embed, view=self)
-        else:
-            # エラー時の処理
-            await interaction.followup.send("❌ 日本語翻訳に失敗しました", ephemeral=True)
-
-    @discord.ui.button(label="English", style=discord.ButtonStyle.primary, custom_id="translate_to_english")
-    async def english_button(self, interaction: discord.Interaction, button: Button):
-        """英語翻訳ボタンがクリックされた時の処理"""
-        # ボタンを無効化
-        button.disabled = True
-        await interaction.response.defer()
+    def remember(self, source_id, reply, index, store_key):
+        self._entries[source_id] = (reply, index, store_key)
+        self._entries.move_to_end(source_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
 
-        # 元のテキストを英語に翻訳
-        english_result = await translate_to_english(self.original_text, self.source_lang)
+    def get(self, source_id):
+        """見つからなければNone"""
+        reply = self._entries.get(source_id)
+        if reply is not None:
+            self._entries.move_to_end(source_id)
+        return reply
 
-        if english_result["success"]:
-            # 既存のEmbedを取得して英語訳を追加
-            original_embed = interaction.message.embeds[0]
-            current_description = original_embed.description
+    def __len__(self):
+        return len(self._entries)
 
-            # 英語訳を追加
-            new_description = current_description + "\n🇺🇸： " + english_result["translated_text"]
 
-            # Embedを更新
-            updated_embed = discord.Embed(
-                description=new_description,
-                color=original_embed.color
-            )
+reply_index = ReplyIndex(REPLY_INDEX_MAX_ENTRIES)
+message_edit_stats = {"received": 0, "updated": 0, "not_tracked": 0, "failed": 0}
 
-            # メッセージを編集（ボタン無効化とEmbed更新）
-            await interaction.message.edit(embed=updated_embed, view=self)
-        else:
-            # エラー時の処理
-            await interaction.followup.send("❌ 英語翻訳に失敗しました", ephemeral=True)
+
+def message_edit_info():
+    return {**message_edit_stats, "sentence_segments": SENTENCE_SEGMENTS, "tracked_replies": len(reply_index)}
 
 # 起動時動作
 @client.event
 async def on_ready():
+    record_startup_phase("gateway_connected")
     print(f"✅ {client.user} として起動しました")
     print(f"📊 サーバー数: {len(client.guilds)}")
+    if SHARDING_ENABLED:
+        print(f"🧩 シャード: {sorted(client.shards)} / 全体 {client.shard_count}")
     print(f"🌍 全チャンネルで自動翻訳が有効です（中国語繁体字 ↔ 韓国語）")
     print(f"🔄 フォールバック: DeepL → Google Translate")
     print(f"🇯🇵🇺🇸 日本語・英語翻訳ボタン機能が有効です")
 
-    # ボタンの永続化（Bot再起動後も動作）
-    # ダミーのViewを追加して、既存のボタンをリッスン
-    client.add_view(TranslationView(original_text="", source_lang="ja"))
 
-    # 定期ヘルスチェックを開始
-    asyncio.create_task(periodic_health_check())
+    # DeepL用の共有HTTPセッションを作成し、文字数枠の定期確認を開始
+    await deepl_client.start()
+    deepl_quota.start()
+
+    # 言語判別・Google翻訳器の準備はGateway接続後にバックグラウンドで行う
+    start_warm_up()
+
+    # 永続キャッシュをバックグラウンドで読み込み開始（起動は待たない）
+    if translation_cache.backend is not None:
+        translation_cache.backend.start()
+        print(f"💾 永続翻訳キャッシュ: {translation_cache.backend.path}")
+    if message_store.backend is not None:
+        message_store.backend.start()
+        print(f"💾 ボタン用メッセージ保存先: {message_store.backend.path}")
+    if deepl_quota.shared is not None:
+        deepl_quota.shared.start()
+        print(f"💾 DeepL使用量の共有先: {deepl_quota.shared.path}")
+
 
 # メッセージ処理
 @client.event
@@ -516,12 +3278,8 @@ async def on_message(message):
     if message.author == client.user:
         return
 
-    # 除外チャンネルチェック
-    if message.channel.id in excluded_channels:
-        return
-
-    # 指定チャンネル限定モードの場合
-    if DISCORD_CHANNEL_ID and message.channel.id != DISCORD_CHANNEL_ID:
+    # 除外チャンネル・指定チャンネル限定モードのチェック
+    if not is_translation_channel(message.channel):
         return
 
     # 空のメッセージや短すぎるメッセージは無視
@@ -564,36 +3322,29 @@ async def on_message(message):
         await message.channel.send(embed=help_embed)
         return
 
+    # メンション・絵文字・URLだけのメッセージは翻訳しない
+    if not has_translatable_text(message.content):
+        return
+
     # 翻訳処理
     try:
-        # 翻訳実行
-        result = await translate_text(message.content)
+        # 起動直後はウォームアップ完了を待つ（重い初期化をメッセージ処理中に行わない）
+        await wait_until_warmed_up()
 
-        if result["success"]:
-            # 翻訳先言語に応じて国旗絵文字を追加
-            if result["target_lang"] == "KO":
-                flag_prefix = "🇰🇷： "
-            elif result["target_lang"] == "ZH-HANT":
-                flag_prefix = "🇹🇼： "
-            else:
-                flag_prefix = ""
-            
-            # 翻訳サービスに応じて色を変更
-            color = 0x00ff00 if result.get("service") == "DeepL" else 0x4285f4  # DeepL=緑, Google=青
-
-            # 埋め込み形式で翻訳後のテキストのみを表示
-            embed = discord.Embed(
-                description=flag_prefix + result["translated_text"],
-                color=color
-            )
+        # 翻訳実行（同時実行数の制限とチャンネル間の公平な順番待ち）
+        async with translation_scheduler.slot(message.channel.id, PRIORITY_AUTO):
+            # 文ごとにキャッシュしておき、編集されたときは変わった文だけ翻訳し直す
+            result = await translate_text(message.content, by_sentence=SENTENCE_SEGMENTS)
 
-            # 韓国語翻訳ボタンを含むViewを作成
-            view = TranslationView(
-                original_text=message.content,
-                source_lang=result["source_lang"]
-            )
-
-            await message.channel.send(embed=embed, view=view)
+        if result["success"]:
+            # 混雑しているチャンネルでは他の翻訳とまとめて1つのメッセージで送る
+            sent_message, index, store_key = await outbound_packer.send(
+                message.channel, translation_embed(result), message.id)
+            record_startup_phase("first_translation")
+
+            # ボタンで翻訳できるよう元のテキストを保存（保存先ファイルがあれば再起動後も）
+            message_store.remember(store_key, message.content, result["source_lang"])
+            reply_index.remember(message.id, sent_message, index, store_key)
         else:
             # エラー時の表示
             error_embed = discord.Embed(
@@ -614,6 +3365,69 @@ async def on_message(message):
         await message.channel.send(f"❌ 予期しないエラーが発生しました: {str(e)}")
         print(f"Error in on_message: {e}")
 
+@client.event
+async def on_message_edit(before, after):
+    """元メッセージが編集されたら翻訳をやり直し、Botの翻訳メッセージを書き換える
+
+    送信時と同じく文ごとに翻訳するため、変わっていない文はキャッシュから組み立てられ、変わった文だけが翻訳APIに送られる。
+    """
+    if after.author == client.user or before.content == after.content:
+        return  # URLのプレビュー追加など本文が変わらない編集は無視
+    if not is_translation_channel(after.channel):
+        return
+
+    message_edit_stats["received"] += 1
+    reply = reply_index.get(after.id)
+    if reply is None or not has_translatable_text(after.content):
+        message_edit_stats["not_tracked"] += 1
+        return
+    reply_message, index, store_key = reply
+
+    try:
+        await wait_until_warmed_up()
+        async with translation_scheduler.slot(after.channel.id, PRIORITY_AUTO):
+            result = await translate(after.content, by_sentence=SENTENCE_SEGMENTS)
+        if not result["success"]:
+            message_edit_stats["failed"] += 1
+            print(f"⚠️ 編集されたメッセージの翻訳に失敗しました: {result['error']}")
+            return
+
+        # 新しい内容でボタン翻訳できるよう保存し直す（以前のボタン翻訳の結果は破棄）
+        message_store.remember(store_key, after.content, result["source_lang"])
+        embed = translation_embed(result)
+        if not await message_editor.replace(reply_message, index, embed.description, embed.color):
+            message_edit_stats["failed"] += 1
+            print("⚠️ 編集されたメッセージの翻訳がメッセージの文字数の上限を超えるため書き換えませんでした")
+            return
+        message_edit_stats["updated"] += 1
+    except Exception as e:
+        message_edit_stats["failed"] += 1
+        print(f"Error in on_message_edit: {e}")
+
+
+def is_translation_channel(channel):
+    """除外チャンネルでなく、指定チャンネル限定モードなら指定のチャンネル"""
+    if channel.id in excluded_channels:
+        return False
+    return not DISCORD_CHANNEL_ID or channel.id == DISCORD_CHANNEL_ID
+
+
+def translation_embed(result):
+    """自動翻訳の結果を表示するEmbed（翻訳先言語の国旗と翻訳サービスの色）"""
+    # 翻訳先言語に応じて国旗絵文字を追加
+    if result["target_lang"] == "KO":
+        flag_prefix = "🇰🇷： "
+    elif result["target_lang"] == "ZH-HANT":
+        flag_prefix = "🇹🇼： "
+    else:
+        flag_prefix = ""
+
+    # 埋め込み形式で翻訳後のテキストのみを表示
+    return discord.Embed(
+        description=flag_prefix + result["translated_text"],
+        color=service_color(result.get("service"))  # 翻訳サービスに応じて色を変更
+    )
+
 # エラーハンドリング
 @client.event
 async def on_error(event, *args, **kwargs):
@@ -624,10 +3438,7 @@ async def on_error(event, *args, **kwargs):
 # Bot実行
 if __name__ == "__main__":
     try:
-        # Keep-alive機能を起動
-        keep_alive()
-        
-        # Discord botを起動
+        # Discord botを起動（ヘルスチェックサーバーは setup_hook で起動）
         client.run(DISCORD_TOKEN)
     except discord.LoginFailure:
         print("❌ Discord トークンが無効です")